@@ -8,26 +8,34 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 import os
+import logging
+from driver_pool import get_driver_pool, time_left
+
+logger = logging.getLogger(__name__)
 
 
 class BaiduScraper:
-    def __init__(self, driver_dir="./driver"):
+    """Baidu search in a browser; used when the plain-HTTP search (engines.json) is blocked."""
+
+    def __init__(self, driver_dir="./driver", pool=None):
         self.driver_dir = driver_dir
         self.driver_path = os.path.join(self.driver_dir, "chromedriver")
-        self.setup_driver()
+        # Drivers are borrowed from a shared pool of warm browsers for each search
+        self.pool = pool or get_driver_pool("baidu", self.setup_driver)
+        self.driver = None
         self.results = []
 
     def setup_driver(self):
         if not os.path.exists(self.driver_dir):
             os.makedirs(self.driver_dir)
-            print(f"Directory created: {self.driver_dir}")
+            logger.info(f"Directory created: {self.driver_dir}")
 
         if not os.path.exists(self.driver_path):
             driver = ChromeDriverManager().install()
             os.rename(driver, self.driver_path)
-            print(f"Driver downloaded to: {self.driver_path}")
+            logger.info(f"Driver downloaded to: {self.driver_path}")
         else:
-            print(f"Driver already exists at: {self.driver_path}")
+            logger.debug(f"Driver already exists at: {self.driver_path}")
 
         chrome_options = Options()
         chrome_options.add_argument("--headless")
@@ -39,33 +47,49 @@ class BaiduScraper:
         chrome_options.add_experimental_option("prefs", prefs)
         chrome_options.add_argument("--log-level=3")
 
-        self.driver = webdriver.Chrome(service=Service(self.driver_path), options=chrome_options)
+        return webdriver.Chrome(service=Service(self.driver_path), options=chrome_options)
+
+    def search(self, query, max_results, stop_at=None):
+        """
+        Search Baidu for query.
 
-    def search(self, query, max_results):
+        :param stop_at: time.monotonic() deadline; no driver is waited for and
+            no further page is loaded after it, and the results so far are returned.
+        """
         self.results = []  # Reset results
         start_time = time.time()
 
-        self.driver.get('https://baidu.com')
-        self.driver.find_element(By.XPATH, '//*[@id="kw"]').send_keys(query)
-        self.driver.find_element(By.XPATH, '//*[@id="su"]').click()
-
-        WebDriverWait(self.driver, 5).until(EC.title_contains(query))
-
-        page_number = 1
-        while len(self.results) < max_results:
-            print(f"\nScraping page {page_number}")
-            self.scrape_page(max_results)
-
-            if len(self.results) >= max_results:
-                print(f"Reached the maximum number of results ({max_results}). Exiting.")
-                break
-
-            if not self.go_to_next_page():
-                break
-            page_number += 1
+        with self.pool.driver(timeout=time_left(stop_at)) as pooled:
+            self.driver = pooled.driver
+            try:
+                pooled.pages += 1
+                self.driver.get('https://baidu.com')
+                self.driver.find_element(By.XPATH, '//*[@id="kw"]').send_keys(query)
+                self.driver.find_element(By.XPATH, '//*[@id="su"]').click()
+
+                WebDriverWait(self.driver, 5).until(EC.title_contains(query))
+
+                page_number = 1
+                while len(self.results) < max_results:
+                    logger.debug(f"Scraping Baidu page {page_number}")
+                    pooled.pages += 1
+                    self.scrape_page(max_results)
+
+                    if len(self.results) >= max_results:
+                        logger.debug(f"Reached the maximum number of results ({max_results}).")
+                        break
+                    if time_left(stop_at) == 0:
+                        logger.debug("Baidu search deadline reached.")
+                        break
+
+                    if not self.go_to_next_page():
+                        break
+                    page_number += 1
+            finally:
+                self.driver = None
 
         total_execution_time = time.time() - start_time
-        print(f"\nTotal time taken for the entire process: {total_execution_time:.2f} seconds")
+        logger.info(f"Baidu search returned {len(self.results)} results in {total_execution_time:.2f} seconds")
 
         return self.results  # Ensure the method returns the results list
 
@@ -77,9 +101,6 @@ class BaiduScraper:
             if self.is_not_ad(container):
                 result = self.get_result_info(container)
                 self.results.append(result)
-                print(f"Title: {result['title']}")
-                print(f"URL: {result['URL']}")
-                print("-" * 50)
 
     def is_not_ad(self, element):
         try:
@@ -120,7 +141,7 @@ class BaiduScraper:
             time.sleep(0.5)
             return True
         except:
-            print("No more pages or error occurred. Exiting.")
+            logger.debug("No more Baidu result pages.")
             return False
 
     def save_results(self, filename="search_results.json"):
@@ -141,10 +162,12 @@ class BaiduScraper:
         print(f"Results appended to {filename}")
 
     def close(self):
-        self.driver.quit()
+        """Shut down the shared driver pool; only meant for standalone use of the scraper."""
+        self.pool.close()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     scraper = BaiduScraper()
     search_query = input("Enter the search query: ")
     max_results = int(input("Enter the number of results to scrape: "))
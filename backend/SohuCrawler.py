@@ -2,17 +2,25 @@ import json
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from bs4 import BeautifulSoup
+from engines import engine_registry
 import sys
 import time
 import os
+import logging
+from driver_pool import get_driver_pool, time_left
+
+logger = logging.getLogger(__name__)
 
 
 class SohuCrawler:
-    def __init__(self, driver_dir="./driver"):
+    """Sohu search in a browser; used when the search data endpoint (engines.json) is blocked."""
+
+    def __init__(self, driver_dir="./driver", pool=None):
         self.driver_dir = driver_dir
         self.driver = None
         self.engine_name = "Sohu"  # Engine name
+        # Drivers are borrowed from a shared pool of warm browsers for each search
+        self.pool = pool or get_driver_pool("sohu", self.setup_driver)
 
     def setup_driver(self):
         chrome_options = Options()
@@ -29,7 +37,7 @@ class SohuCrawler:
             )
 
         service = Service(driver_path)
-        self.driver = webdriver.Chrome(service=service, options=chrome_options)
+        return webdriver.Chrome(service=service, options=chrome_options)
 
     @staticmethod
     def is_valid_result(result):
@@ -49,97 +57,92 @@ class SohuCrawler:
         # Only return true if all conditions are satisfied and content is not a single number
         return has_title and has_content and has_valid_link and not is_single_number
 
-    def scrape_sohu_search(self, keyword, max_results=10):
+    def scrape_sohu_search(self, keyword, max_results=10, stop_at=None):
         """
         Scrape Sohu search results for the given keyword.
 
         :param keyword: The keyword to search.
         :param max_results: The maximum number of results to return.
+        :param stop_at: time.monotonic() deadline for getting a driver from the pool.
         :return: A list of valid search results.
         """
         url = f"https://search.sohu.com/?keyword={keyword}"
-        self.setup_driver()
 
-        try:
-            self.driver.get(url)
-            print(f"Successfully loaded the page. Current URL: {self.driver.current_url}")
-
-            time.sleep(1)  # Wait for the page to load completely
-
-            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(1)  # Wait for any additional content to load
-
-            page_source = self.driver.page_source
-            soup = BeautifulSoup(page_source, 'html.parser')
-
-            print("First 1000 characters of the HTML after JavaScript rendering:")
-            print(soup.prettify()[:1000])
-
-            results = []
-            seen_titles = set()
-            seen_contents = set()
-            seen_title_content_combinations = set()
-
-            # Locate the main container with class "search-content-left"
-            main_container = soup.find('div', class_='search-content-left')
-            if not main_container:
-                print("Main container with class 'search-content-left' not found.")
-                return results
-
-            # Extract individual result items within the main container
-            # Adjust the selector based on the actual HTML structure
-            potential_result_containers = main_container.find_all('div', class_=lambda x: x and 'result-item' in x)
-
-            if potential_result_containers:
-                for container in potential_result_containers:
-                    if len(results) >= max_results:
-                        break  # Stop if we have reached the max number of results
-                    print(f"Found potential result container: {container.get('class')}")
-                    link_tag = container.find('a', href=True)
-                    description_tag = container.find('p')  # Assuming description is within a <p> tag
-
-                    if link_tag:
-                        title = link_tag.get_text(strip=True)
-                        href = link_tag.get('href')
-                        content = description_tag.get_text(strip=True) if description_tag else "No content found"
-
-                        # Normalize title and content
-                        normalized_title = title.strip().lower()
-                        normalized_content = content.strip().lower()
-
-                        # Create unique keys
-                        title_key = normalized_title
-                        content_key = normalized_content
-                        title_vs_content_key = (normalized_title, normalized_content)
-                        content_vs_title_key = (normalized_content, normalized_title)
-
-                        result = {
-                            'engine_name': self.engine_name,
-                            'title': title,
-                            'content': content,
-                            'link': href,
-                        }
-
-                        if self.is_valid_result(result):
-                            if (title_key not in seen_titles and
-                                    content_key not in seen_contents and
-                                    title_vs_content_key not in seen_title_content_combinations and
-                                    content_vs_title_key not in seen_title_content_combinations):
-                                results.append(result)
-                                seen_titles.add(title_key)
-                                seen_contents.add(content_key)
-                                seen_title_content_combinations.add(title_vs_content_key)
-                                seen_title_content_combinations.add(content_vs_title_key)
-
-            if not results:
-                print("No valid results found within 'search-content-left'. Dumping all links on the page:")
-                for link in main_container.find_all('a'):
-                    print(f"Text: {link.text.strip()}, href: {link.get('href')}")
-
-            return results[:max_results]  # Only return up to the number of max results requested
-
-        finally:
-            self.driver.quit()
+        with self.pool.driver(timeout=time_left(stop_at)) as pooled:
+            self.driver = pooled.driver
+            pooled.pages += 1
+            try:
+                return self._scrape_loaded_page(url, max_results)
+            finally:
+                self.driver = None
+
+    def _scrape_loaded_page(self, url, max_results):
+        self.driver.get(url)
+        logger.debug(f"Loaded Sohu results page {url}")
+
+        time.sleep(1)  # Wait for the page to load completely
+
+        self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        time.sleep(1)  # Wait for any additional content to load
+
+        return self.parse_results(self.driver.page_source, max_results)
+
+    def parse_results(self, page_source, max_results):
+        """Extract valid, de-duplicated results from a rendered Sohu search page."""
+        parser = engine_registry.get('sohu').browser_parser
+        results = []
+        seen_titles = set()
+        seen_contents = set()
+        seen_title_content_combinations = set()
+
+        # Locate the main container with class "search-content-left"
+        if parser.container_start not in page_source:
+            logger.warning("Main container with class 'search-content-left' not found.")
+            return results
+
+        # Extract individual result items within the main container
+        for container in parser.find_results(page_source):
+            if len(results) >= max_results:
+                break  # Stop if we have reached the max number of results
+            extracted = parser.extract(container)
+
+            if extracted:
+                title = extracted['title']
+                href = extracted['URL']
+                content = extracted['content']
+
+                # Normalize title and content
+                normalized_title = title.strip().lower()
+                normalized_content = content.strip().lower()
+
+                # Create unique keys
+                title_key = normalized_title
+                content_key = normalized_content
+                title_vs_content_key = (normalized_title, normalized_content)
+                content_vs_title_key = (normalized_content, normalized_title)
+
+                result = {
+                    'engine_name': self.engine_name,
+                    'title': title,
+                    'content': content,
+                    'link': href,
+                }
+
+                if self.is_valid_result(result):
+                    if (title_key not in seen_titles and
+                            content_key not in seen_contents and
+                            title_vs_content_key not in seen_title_content_combinations and
+                            content_vs_title_key not in seen_title_content_combinations):
+                        results.append(result)
+                        seen_titles.add(title_key)
+                        seen_contents.add(content_key)
+                        seen_title_content_combinations.add(title_vs_content_key)
+                        seen_title_content_combinations.add(content_vs_title_key)
+
+        if not results:
+            logger.warning("No valid results found within 'search-content-left'.")
+
+        return results[:max_results]  # Only return up to the number of max results requested
 
     @staticmethod
     def append_results_to_json(results, filename="search_results.json"):
@@ -161,6 +164,7 @@ class SohuCrawler:
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     keyword = input("Enter the search keyword: ")
     max_results = int(input("Enter the number of results to retrieve: "))
 
@@ -181,6 +185,7 @@ if __name__ == "__main__":
         print("Please make sure the ChromeDriver is in the correct location.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
+    finally:
+        crawler.pool.close()
 
     print(f"\nPython version: {sys.version}")
-    print(f"BeautifulSoup version: {BeautifulSoup.__version__ if hasattr(BeautifulSoup, '__version__') else 'Not available'}")
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from cache import SQLiteBackend, TTLCache
+from sort import Sort, load_word_vectors, tokenize
+
+# Answers depend only on the question and the context, so they stay valid for long
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', 86400))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 10000))
+ANSWER_CACHE_BACKEND = os.environ.get('ANSWER_CACHE_BACKEND', 'sqlite')  # sqlite or memory
+ANSWER_CACHE_PATH = os.environ.get('ANSWER_CACHE_PATH', 'answer_cache.db')
+# Cosine similarity above which a differently worded question about the same search reuses an answer;
+# only used when pretrained word vectors are configured
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', 0.95))
+MEMORY_ENTRIES = 1000
+QUESTIONS_PER_SEARCH = 50
+MAX_INDEXED_SEARCHES = 1000
+
+QUESTION_END = '?？.。!！ '
+
+
+def normalize_question(question):
+    """Whitespace, case and trailing punctuation differences do not change a question."""
+    return ' '.join(question.split()).casefold().rstrip(QUESTION_END)
+
+
+def context_fingerprint(context):
+    return hashlib.sha1(context.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache of generated answers keyed by the normalized question, the provider
+    and model, and a fingerprint of the prompt context.
+
+    Recently used answers are kept in an in-memory TTL/LRU tier in front of
+    an optional SQLite backend shared by the worker processes. With word
+    vectors available, a miss falls back to the most similar earlier
+    question about the same search that was answered from the same context.
+    """
+
+    def __init__(self, backend=None, ttl=ANSWER_CACHE_TTL, similarity=ANSWER_CACHE_SIMILARITY, word_vectors=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.similarity = similarity
+        self.word_vectors = word_vectors
+        self.hits = 0
+        self.misses = 0
+        self._memory = TTLCache(max_entries=MEMORY_ENTRIES, ttl=ttl)
+        # (search id, provider, model, context fingerprint) -> [(question vector, key), ...], most recent last
+        self._questions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question, context, provider, model):
+        payload = json.dumps([normalize_question(question), (provider or '').lower(), model,
+                              context_fingerprint(context)], ensure_ascii=False)
+        return "answer:" + hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def index_key(search_id, provider, model, context):
+        return search_id, (provider or '').lower(), model, context_fingerprint(context or '')
+
+    def _load(self, key):
+        entry = self._memory.get(key)
+        if entry is None and self.backend is not None:
+            stored = self.backend.get(key)
+            if stored is not None:
+                entry = stored[0]
+                self._memory.set(key, entry, ttl=max(stored[2] - time.time(), 0))
+        return entry
+
+    def _question_vector(self, question):
+        if self.word_vectors is None:
+            return None
+        tokens = [token for token in tokenize(normalize_question(question)) if token.strip()]
+        vector = Sort.mean_vectors([tokens], self.word_vectors)[0]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _find_similar(self, question, search_id, provider, model, context):
+        vector = self._question_vector(question)
+        if vector is None:
+            return None
+        with self._lock:
+            candidates = list(self._questions.get(self.index_key(search_id, provider, model, context), ()))
+        best_key, best_similarity = None, self.similarity
+        for candidate, key in candidates:
+            similarity = float(np.dot(vector, candidate))
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+        return self._load(best_key) if best_key else None
+
+    def get(self, key, question=None, search_id=None, provider=None, model=None, context=None):
+        """Return the cached entry for key, or for a near-duplicate question with the same search and context."""
+        entry = self._load(key)
+        if entry is None and question and search_id:
+            entry = self._find_similar(question, search_id, provider, model, context)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry, question=None, search_id=None, provider=None, model=None, context=None):
+        self._memory.set(key, entry)
+        if self.backend is not None:
+            expires_at = time.time() + self.ttl
+            self.backend.set(key, entry, expires_at, expires_at)
+
+        vector = self._question_vector(question) if question and search_id else None
+        if vector is None:
+            return
+        index_key = self.index_key(search_id, provider, model, context)
+        with self._lock:
+            questions = self._questions.setdefault(index_key, [])
+            questions.append((vector, key))
+            del questions[:-QUESTIONS_PER_SEARCH]
+            self._questions.move_to_end(index_key)
+            while len(self._questions) > MAX_INDEXED_SEARCHES:
+                self._questions.popitem(last=False)
+
+
+def create_answer_cache():
+    """Build the answer cache configured by ANSWER_CACHE_BACKEND (sqlite or memory)."""
+    backend = None
+    if ANSWER_CACHE_BACKEND != 'memory':
+        backend = SQLiteBackend(ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_MAX_ENTRIES)
+    return AnswerCache(backend, word_vectors=load_word_vectors())
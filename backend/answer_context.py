@@ -0,0 +1,128 @@
+import math
+import os
+import re
+
+from sort import tokenize
+
+# Prompt context limits for /answer
+ANSWER_TOKEN_BUDGET = int(os.environ.get('ANSWER_TOKEN_BUDGET', 3000))
+ANSWER_TOP_K = int(os.environ.get('ANSWER_TOP_K', 8))
+PASSAGE_CHARS = 400
+MAX_PASSAGES_PER_RESULT = 3
+# Only the beginning of very long page texts is considered
+MAX_CONTENT_CHARS = 8000
+
+# Passage scoring, BM25 over the candidate passages
+PASSAGE_K1 = 1.2
+PASSAGE_B = 0.75
+
+# Budget for the " ... " between passages and line breaks
+PASSAGE_SEPARATOR_TOKENS = 2
+
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+SENTENCE_END = re.compile(r'(?<=[。！？!?.\n])\s*')
+
+
+def estimate_tokens(text):
+    """Rough token count without a tokenizer: one per CJK character, one per four other characters."""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_passages(content, passage_chars=PASSAGE_CHARS):
+    """Split text into passages of about passage_chars characters along sentence boundaries."""
+    passages, current = [], ''
+    for sentence in SENTENCE_END.split(content[:MAX_CONTENT_CHARS]):
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) > passage_chars:
+            passages.append(current)
+            current = ''
+        # Sentences longer than a passage are cut into pieces
+        while len(sentence) > passage_chars:
+            passages.append(sentence[:passage_chars])
+            sentence = sentence[passage_chars:]
+        current += sentence
+    if current.strip():
+        passages.append(current)
+    return [passage.strip() for passage in passages if passage.strip()]
+
+
+def terms(text):
+    return [token for token in tokenize(text) if any(char.isalnum() for char in token)]
+
+
+class ContextBuilder:
+    """
+    Builds a bounded answer context from ranked search results.
+
+    The top_k results by score are split into passages. Passages are scored
+    against the question with BM25, weighted by their result's score, and
+    picked greedily (at most MAX_PASSAGES_PER_RESULT per result) until the
+    token budget is used up. Picked passages are rendered per result in rank
+    order and in their original order within the page.
+    """
+
+    def __init__(self, token_budget=ANSWER_TOKEN_BUDGET, top_k=ANSWER_TOP_K):
+        self.token_budget = token_budget
+        self.top_k = top_k
+
+    @staticmethod
+    def result_header(result):
+        return f"Title: {result.get('title', '')}\nURL: {result.get('URL', '')}\nScore: {result.get('score', 0)}\nContent: "
+
+    def score_passages(self, question, passages):
+        """BM25 relevance of every (result index, passage index, text) in passages to question."""
+        query_terms = set(terms(question))
+        passage_terms = [terms(text) for _, _, text in passages]
+        if not query_terms or not passages:
+            return [0.0] * len(passages)
+
+        average_length = sum(len(tokens) for tokens in passage_terms) / len(passages) or 1
+        document_frequency = {term: sum(term in tokens for tokens in passage_terms) for term in query_terms}
+        scores = []
+        for tokens in passage_terms:
+            score = 0.0
+            length_norm = PASSAGE_K1 * (1 - PASSAGE_B + PASSAGE_B * len(tokens) / average_length)
+            for term in query_terms:
+                frequency = tokens.count(term)
+                if frequency:
+                    df = document_frequency[term]
+                    idf = math.log(1 + (len(passages) - df + 0.5) / (df + 0.5))
+                    score += idf * frequency * (PASSAGE_K1 + 1) / (frequency + length_norm)
+            scores.append(score)
+        return scores
+
+    def select(self, results, question):
+        """Return [(result, [passage, ...]), ...] for the chosen passages in rank order."""
+        ranked = sorted(results, key=lambda result: result.get('score', 0), reverse=True)[:self.top_k]
+        passages = [(rank, index, text)
+                    for rank, result in enumerate(ranked)
+                    for index, text in enumerate(split_passages(result.get('content') or ''))]
+        relevance = self.score_passages(question, passages)
+
+        top_score = max((result.get('score', 0) for result in ranked), default=0) or 1
+        # Passages of better ranked results win ties; relevant passages beat rank alone
+        priority = [(1 + relevance[i]) * (0.5 + 0.5 * ranked[rank].get('score', 0) / top_score)
+                    for i, (rank, _, _) in enumerate(passages)]
+
+        used = 0
+        chosen = {}
+        for i in sorted(range(len(passages)), key=lambda i: (-priority[i], i)):
+            rank, index, text = passages[i]
+            cost = estimate_tokens(text) + PASSAGE_SEPARATOR_TOKENS
+            if rank not in chosen:
+                cost += estimate_tokens(self.result_header(ranked[rank]))
+            if used + cost > self.token_budget or len(chosen.get(rank, ())) >= MAX_PASSAGES_PER_RESULT:
+                continue
+            chosen.setdefault(rank, []).append((index, text))
+            used += cost
+
+        return [(ranked[rank], [text for _, text in sorted(chosen[rank])]) for rank in sorted(chosen)]
+
+    def build(self, results, question):
+        """Render the selected passages as the prompt context."""
+        return "\n".join(
+            self.result_header(result) + " ... ".join(passages) + "\n"
+            for result, passages in self.select(results, question)
+        )
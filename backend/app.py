@@ -1,19 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from BaiduCrawler import BaiduScraper
 from SohuCrawler import SohuCrawler
 from crawler import SearchEngineScraper
-from sort import Sort  # Use the modified Sort class
+from async_crawler import AsyncSearchEngine
+from engines import EngineDefinition, engine_registry
+from rate_limiter import rate_limiter
+from engine_health import engine_health
+from hedging import hedge_policy
+from sort import Sort, load_word_vectors  # Use the modified Sort class
 from summarize import AIQuestionAnswerer
 from process_result import JsonCleaner  # Import the JsonCleaner class
 import os
 import json
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_caching import Cache
+from cache import create_search_cache, make_search_key, search_id_from_key, search_key_from_id
+from answer_cache import create_answer_cache
+from singleflight import SingleFlight
+from metrics import registry as metrics_registry, timed
+from logging_config import setup_logging, log_payload
 import re
 import string
+import threading
+import time
+
+# Queue-backed structured logging; must be set up before app.logger is first used
+setup_logging()
 
 app = Flask(__name__)
 CORS(app)
@@ -24,10 +37,18 @@ limiter = Limiter(
 )
 limiter.init_app(app)  # Properly initialize the Limiter with the Flask app
 
-# 缓存配置：开发环境中使用SimpleCache，生产环境建议使用RedisCache
-cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+# 搜索结果缓存：默认使用所有worker共享的SQLite文件，过期后先返回旧结果再后台刷新
+search_cache = create_search_cache()
+metrics_registry.register_cache('search', lambda: (search_cache.hits, search_cache.misses))
+# 问题与上下文相同（或在同一搜索上语义相近）的回答直接复用，不再调用模型
+answer_cache = create_answer_cache()
+metrics_registry.register_cache('answer', lambda: (answer_cache.hits, answer_cache.misses))
+# 相同的并发搜索只爬取一次，其余请求（包括其他worker）等待并复用结果
+search_flight = SingleFlight()
 
 SEARCH_ENGINES_FILE = 'search_engines.json'
+# Fields of a structured engine definition accepted by POST /api/search-engines
+ENGINE_CONFIG_KEYS = ('url', 'pagination', 'page_size', 'offset_start', 'max_results', 'mobile', 'selectors')
 
 # Define the keyword_pattern regex for validation
 keyword_pattern = re.compile(r'^[A-Za-z0-9 \u4e00-\u9fa5]{1,100}$')  # Adjusted to include Chinese characters
@@ -41,8 +62,11 @@ def load_search_engines():
 
 # Save search engines
 def save_search_engines(search_engines):
-    with open(SEARCH_ENGINES_FILE, 'w') as f:
+    # Written to a temporary file and renamed, so other workers never read a half-written file
+    temporary_file = f"{SEARCH_ENGINES_FILE}.{os.getpid()}.tmp"
+    with open(temporary_file, 'w') as f:
         json.dump(search_engines, f, indent=4)
+    os.replace(temporary_file, SEARCH_ENGINES_FILE)
 
 @app.route('/api/search-engines', methods=['GET'])
 def get_search_engines():
@@ -51,7 +75,16 @@ def get_search_engines():
 
 @app.route('/api/search-engines', methods=['POST'])
 def add_search_engine():
-    data = request.json
+    """
+    Register a search engine.
+
+    With just a url, the engine's result page is scraped for links. Passing a
+    name and selectors (and optionally pagination, page_size, offset_start,
+    max_results and mobile, see engines.json) registers a structured engine
+    whose results are parsed and ranked like the built-in ones; its url is
+    then a template containing {query}.
+    """
+    data = request.json or {}
     url = data.get('url')
 
     if not url:
@@ -63,24 +96,30 @@ def add_search_engine():
     if not parsed_url.scheme or not parsed_url.netloc:
         return jsonify({'success': False, 'message': 'Invalid URL format.'}), 400
 
-    try:
-        scraper = SearchEngineScraper(url)
-        links = scraper.extract_links()
-        search_engines = load_search_engines()
-
-        new_engine = {
-            'id': len(search_engines) + 1,
-            'url': url,
-            'links': links
-        }
-
-        search_engines.append(new_engine)
-        save_search_engines(search_engines)
+    search_engines = load_search_engines()
+    new_engine = {
+        'id': max((engine['id'] for engine in search_engines), default=0) + 1,
+        'url': url,
+    }
+
+    if data.get('selectors'):
+        name = str(data.get('name') or '').lower()
+        if engine_registry.get(name) is not None:
+            return jsonify({'success': False, 'message': f'Search engine {name} already exists.'}), 409
+        config = {key: data[key] for key in ENGINE_CONFIG_KEYS if key in data}
+        # Result links of third-party engines are often relative to the result page
+        config.setdefault('resolve_urls', True)
+        try:
+            definition = EngineDefinition.from_config(name, config)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        engine_registry.register(definition)
+        new_engine.update(name=definition.name, definition=config)
 
-        return jsonify({'success': True, 'searchEngine': new_engine}), 201
+    search_engines.append(new_engine)
+    save_search_engines(search_engines)
 
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
+    return jsonify({'success': True, 'searchEngine': new_engine}), 201
 
 @app.route('/api/search-engines/<int:engine_id>', methods=['DELETE'])
 def delete_search_engine(engine_id):
@@ -90,151 +129,375 @@ def delete_search_engine(engine_id):
     if len(updated_search_engines) == len(search_engines):
         return jsonify({'success': False, 'message': 'Search engine not found.'}), 404
 
+    for engine in search_engines:
+        if engine['id'] == engine_id and engine.get('definition'):
+            engine_registry.unregister(engine['name'])
+
     save_search_engines(updated_search_engines)
     return jsonify({'success': True, 'message': 'Search engine deleted successfully.'}), 200
 
-def scrape_engine(engine, keyword, max_results):
+# Modification time of search_engines.json when this worker last loaded it, and the engines it registered
+_saved_engines_mtime = None
+_saved_engine_names = set()
+_saved_engines_lock = threading.Lock()
+
+def register_saved_engines():
+    """
+    Make the engine registry match the structured engines in search_engines.json.
+
+    Engines are added and deleted through whichever worker handled the
+    request, so every worker reloads the file whenever its modification time
+    changes; this also makes them survive restarts.
+    """
+    global _saved_engines_mtime, _saved_engine_names
+    try:
+        mtime = os.stat(SEARCH_ENGINES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _saved_engines_lock:
+        if mtime == _saved_engines_mtime:
+            return
+        try:
+            saved_engines = load_search_engines()
+        except (OSError, ValueError) as e:
+            app.logger.warning(f"Could not load {SEARCH_ENGINES_FILE}: {e}")
+            return
+        names = set()
+        for engine in saved_engines:
+            if not engine.get('definition'):
+                continue
+            try:
+                definition = EngineDefinition.from_config(engine['name'], engine['definition'])
+            except ValueError as e:
+                app.logger.warning(f"Skipping saved search engine {engine.get('name')}: {e}")
+                continue
+            engine_registry.register(definition)
+            names.add(definition.name)
+        for name in _saved_engine_names - names:
+            engine_registry.unregister(name)
+        _saved_engines_mtime, _saved_engine_names = mtime, names
+
+register_saved_engines()
+
+@app.before_request
+def sync_saved_engines():
+    # One stat() per request picks up engines other workers added or deleted
+    register_saved_engines()
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    # Prometheus text format: stage latencies, bytes fetched, cache hit ratios, engine errors
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/rate-limits', methods=['GET'])
+def get_rate_limits():
+    # Per-host politeness budget usage of the shared crawler rate limiter
+    return jsonify({'limits': rate_limiter.limits, 'hosts': rate_limiter.stats(), 'hedging': hedge_policy.stats()}), 200
+
+@app.route('/api/engine-health', methods=['GET'])
+def get_engine_health():
+    # Rolling latency, outcome and circuit breaker state of every engine searched so far
+    return jsonify({'engines': engine_health.stats()}), 200
+
+def scrape_engine(engine, keyword, max_results, stop_at=None):
     name = engine.get('name')
+    if stop_at is not None and time.monotonic() >= stop_at:
+        # Queued behind other blocking scrapes until the engine's deadline had passed
+        return []
+    with timed('scrape', name.lower() if isinstance(name, str) else 'custom'):
+        return _scrape_engine(name, keyword, max_results, stop_at)
+
+def _scrape_engine(name, keyword, max_results, stop_at=None):
     try:
-        if name.lower() == 'bing':
-            crawler = SearchEngineScraper()
-            return crawler.scrape_search_engine('bing', keyword, max_results)
+        if isinstance(name, dict) and 'url' in name:
+            # Handle custom search engine registered by URL only
+            custom_scraper = SearchEngineScraper()
+            custom_results = custom_scraper.scrape_custom_search_engine(name['url'], keyword)
+            return custom_results if custom_results else []
         elif name.lower() == 'baidu':
+            # Baidu and Sohu are searched over HTTP; the browser is only used once that gets blocked
             baidu_scraper = BaiduScraper()
-            baidu_results = baidu_scraper.search(keyword, max_results)
+            baidu_results = baidu_scraper.search(keyword, max_results, stop_at)
             return baidu_results if baidu_results else []
         elif name.lower() == 'sohu':
             sohu_scraper = SohuCrawler()
-            sohu_results = sohu_scraper.scrape_sohu_search(keyword, max_results)
+            sohu_results = sohu_scraper.scrape_sohu_search(keyword, max_results, stop_at)
             return sohu_results if sohu_results else []
-        elif name.lower() in ['sogou', 'mso', 'quark']:
+        elif engine_registry.is_http_engine(name):
             crawler = SearchEngineScraper()
             return crawler.scrape_search_engine(name.lower(), keyword, max_results)
-        elif isinstance(name, dict) and 'url' in name:
-            # Handle custom search engine
-            custom_scraper = SearchEngineScraper()
-            custom_results = custom_scraper.scrape_custom_search_engine(name['url'], keyword)
-            return custom_results if custom_results else []
         else:
-            print(f"Unsupported search engine: {name}")
+            app.logger.warning(f"Unsupported search engine: {name}")
             return []
     except Exception as e:
-        print(f"Error scraping {name}: {e}")
+        app.logger.error(f"Error scraping {name}: {e}")
         return []
 
-@app.route('/search', methods=['POST'])
-@limiter.limit("10 per minute")
-def search():
+# Shared async scraping core: HTTP engines run on one event loop, browser engines on its thread pool
+search_runner = AsyncSearchEngine(scrape_engine)
+
+# Load the pretrained ranking embeddings (if WORD_VECTORS_PATH is set) at startup, not during a request
+if load_word_vectors() is None:
+    app.logger.warning("WORD_VECTORS_PATH is not set; ranking without embedding similarity "
+                       "and without semantic answer cache lookups")
+
+# Browsers are only needed when the Baidu or Sohu HTTP search is blocked, so the pools start
+# them on first use; DRIVER_POOL_PREWARM=1 starts them with the app instead
+if os.environ.get('DRIVER_POOL_PREWARM', '0') == '1':
+    BaiduScraper().pool.warm()
+    SohuCrawler().pool.warm()
+
+class CleaningError(Exception):
+    pass
+
+def ndjson_frame(payload):
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+def tag_engine_results(engine, engine_results):
+    # Ensure each result has the engine_name
+    for result in engine_results:
+        result['engine_name'] = engine['name']
+    return engine_results
+
+def rank_results(results, keyword, enrich=True):
+    """Clean (and optionally enrich) results and rank them for keyword."""
+    # 清理结果
+    cleaner = JsonCleaner()
     try:
-        data = request.json
-        app.logger.info(f"Received search request data: {data}")
+        cleaned_results = cleaner.clean_json_data(results, enrich=enrich)
+    except Exception as e:
+        raise CleaningError(f"Cleaning failed: {str(e)}") from e
 
-        if data is None:
-            app.logger.error("No JSON data received in the request")
-            return jsonify({'status': 'error', 'message': 'No JSON data received'}), 400
+    # 排序结果
+    sorter = Sort(cleaned_results, keyword)
+    return sorter.run_sorting()
 
-        keyword = data.get('keyword', '').strip()
-        search_engines = data.get('search_engines', [])
+def run_search(keyword, search_engines):
+    """Scrape, clean and rank results for keyword; returns the /search response body."""
+    results = []
 
-        app.logger.info(f"Keyword: {keyword}")
-        app.logger.info(f"Search engines: {search_engines}")
+    engines = [engine for engine in search_engines if engine.get('name')]
+    with timed('scrape_all'):
+        for engine, engine_results in search_runner.search(engines, keyword):
+            results.extend(tag_engine_results(engine, engine_results))
 
-        if not keyword:
-            app.logger.error("Empty keyword received")
-            return jsonify({'status': 'error', 'message': 'Keyword cannot be empty'}), 400
+    # Full payloads are only dumped for a sampled fraction of searches
+    log_payload(app.logger, "Search results", results)
 
-        # Define cache_key here
-        cache_key = f"search:{keyword}"
+    sorted_results = rank_results(results, keyword)
 
-        # Check cache
-        cached_response = cache.get(cache_key)
-        if cached_response:
-            app.logger.info(f"Returning cached response for keyword: {keyword}")
-            return jsonify(cached_response), 200
+    app.logger.info("Search completed", extra={'keyword': keyword, 'results': len(results),
+                                               'ranked': len(sorted_results)})
+    log_payload(app.logger, "Sorted results", sorted_results)
 
-        # 输入验证：仅允许字母、数字、中文字符、空格和常见标点符号，长度1-100
-        allowed_chars = string.ascii_letters + string.digits + string.whitespace + ',.?!，。？！'
-        keyword_pattern = re.compile(f'^[{re.escape(allowed_chars)}\u4e00-\u9fa5]{{1,100}}$')
-        if not keyword_pattern.match(keyword):
-            app.logger.error(f"Invalid keyword format: {keyword}")
-            return jsonify({'status': 'error', 'message': 'Invalid keyword format'}), 400
+    return {'status': 'success', 'results': sorted_results}
 
-        if not search_engines:
-            app.logger.error("No search engines specified")
-            return jsonify({'status': 'error', 'message': 'At least one search engine must be specified'}), 400
+def get_fresh_cached(cache_key):
+    cached_response, is_stale = search_cache.get(cache_key)
+    return None if is_stale else cached_response
 
-        results = []
+def search_once(cache_key, keyword, search_engines):
+    """Run a search at most once across concurrent identical requests and store it in the shared cache."""
+    def search_and_cache():
+        response = run_search(keyword, search_engines)
+        search_cache.set(cache_key, response)
+        return response
 
-        with ProcessPoolExecutor(max_workers=4) as executor:
-            future_to_engine = {
-                executor.submit(scrape_engine, engine, keyword, engine.get('resultsCount', 10)): engine
-                for engine in search_engines if engine.get('name')
-            }
-
-            for future in as_completed(future_to_engine):
-                engine = future_to_engine[future]
-                try:
-                    engine_results = future.result()
-                    if engine_results:
-                        # Ensure each result has the engine_name
-                        for result in engine_results:
-                            result['engine_name'] = engine['name']
-                        results.extend(engine_results)
-                except Exception as e:
-                    app.logger.error(f"Error processing engine {engine.get('name')}: {e}")
-
-        # Log the results before sending
-        app.logger.info(f"Search results: {results}")
-
-        # 清理结果
-        cleaner = JsonCleaner()
-        try:
-            cleaned_results = cleaner.clean_json_data(results)
-        except Exception as e:
-            return jsonify({'status': 'error', 'message': f"Cleaning failed: {str(e)}"}), 500
+    # Workers that waited on another worker's crawl pick its result up from the shared cache
+    return search_flight.do(cache_key, search_and_cache, check=lambda: get_fresh_cached(cache_key))
 
-        # 排序结果
-        sorter = Sort(cleaned_results, keyword)
-        sorted_results = sorter.run_sorting()
+def parse_search_request(data):
+    """Validate a /search request body; returns (keyword, search_engines, error_response)."""
+    if data is None:
+        app.logger.error("No JSON data received in the request")
+        return None, None, (jsonify({'status': 'error', 'message': 'No JSON data received'}), 400)
 
-        # Add this logging
-        print("Sorted results:", json.dumps(sorted_results, indent=2))
+    keyword = data.get('keyword', '').strip()
+    search_engines = data.get('search_engines', [])
 
-        response = {'status': 'success', 'results': sorted_results}
-        cache.set(cache_key, response, timeout=300)  # Cache for 5 minutes
-        return jsonify(response)
+    app.logger.debug("Parsed search request", extra={'keyword': keyword, 'search_engines': search_engines})
+
+    if not keyword:
+        app.logger.error("Empty keyword received")
+        return None, None, (jsonify({'status': 'error', 'message': 'Keyword cannot be empty'}), 400)
+
+    # 输入验证：仅允许字母、数字、中文字符、空格和常见标点符号，长度1-100
+    allowed_chars = string.ascii_letters + string.digits + string.whitespace + ',.?!，。？！'
+    keyword_pattern = re.compile(f'^[{re.escape(allowed_chars)}\u4e00-\u9fa5]{{1,100}}$')
+    if not keyword_pattern.match(keyword):
+        app.logger.error(f"Invalid keyword format: {keyword}")
+        return None, None, (jsonify({'status': 'error', 'message': 'Invalid keyword format'}), 400)
+
+    if not search_engines:
+        app.logger.error("No search engines specified")
+        return None, None, (jsonify({'status': 'error', 'message': 'At least one search engine must be specified'}), 400)
+
+    return keyword, search_engines, None
+
+@app.route('/search', methods=['POST'])
+@limiter.limit("10 per minute")
+def search():
+    try:
+        data = request.json
+        app.logger.info("Received search request", extra={'request_data': data})
+
+        keyword, search_engines, error_response = parse_search_request(data)
+        if error_response:
+            return error_response
+
+        # The key covers the keyword, the selected engines and their result counts
+        cache_key = make_search_key(keyword, search_engines)
+
+        # Check cache; stale entries are served immediately and refreshed in the background
+        cached_response, is_stale = search_cache.get(cache_key)
+        if cached_response:
+            app.logger.info(f"Returning {'stale' if is_stale else 'cached'} response for keyword: {keyword}")
+            if is_stale:
+                search_cache.revalidate(cache_key, lambda: search_once(cache_key, keyword, search_engines))
+            return jsonify(dict(cached_response, search_id=search_id_from_key(cache_key))), 200
+
+        try:
+            with timed('search'):
+                response = search_once(cache_key, keyword, search_engines)
+        except CleaningError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+        # The search id lets /answer use exactly these results
+        with timed('serialize'):
+            return jsonify(dict(response, search_id=search_id_from_key(cache_key)))
 
     except Exception as e:
         app.logger.error(f"Unexpected error in search function: {str(e)}")
         return jsonify({'status': 'error', 'message': 'An unexpected error occurred'}), 500
 
+@app.route('/search/stream', methods=['POST'])
+@limiter.limit("10 per minute")
+def search_stream():
+    """
+    Streaming variant of /search that answers with newline delimited JSON frames.
+
+    One "engine" frame carries each engine's raw results as soon as that engine
+    finishes, followed by a "provisional" frame ranking everything received so
+    far without enrichment. A "final" frame carries the fully cleaned and
+    re-ranked results, in the same shape as the /search response.
+    """
+    data = request.json
+    app.logger.info("Received streaming search request", extra={'request_data': data})
+
+    keyword, search_engines, error_response = parse_search_request(data)
+    if error_response:
+        return error_response
+
+    cache_key = make_search_key(keyword, search_engines)
+    cached_response = get_fresh_cached(cache_key)
+
+    def generate():
+        if cached_response:
+            yield ndjson_frame(dict(cached_response, type='final', search_id=search_id_from_key(cache_key)))
+            return
+
+        results = []
+        try:
+            engines = [engine for engine in search_engines if engine.get('name')]
+            for engine, engine_results in search_runner.iter_search(engines, keyword):
+                tag_engine_results(engine, engine_results)
+                yield ndjson_frame({'type': 'engine', 'engine': engine['name'], 'results': engine_results})
+
+                results.extend(engine_results)
+                provisional = rank_results([dict(result) for result in results], keyword, enrich=False)
+                yield ndjson_frame({'type': 'provisional', 'results': provisional})
+
+            response = {'status': 'success', 'results': rank_results(results, keyword)}
+            search_cache.set(cache_key, response)
+            yield ndjson_frame(dict(response, type='final', search_id=search_id_from_key(cache_key)))
+        except Exception as e:
+            app.logger.error(f"Unexpected error in streaming search: {str(e)}")
+            yield ndjson_frame({'type': 'error', 'status': 'error', 'message': 'An unexpected error occurred'})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/answer', methods=['POST'])
 def answer():
-    data = request.json
+    """
+    Answer a question from the results of an earlier search.
+
+    search_id comes from the /search response; the answer context is built
+    from that search's ranked results within the configured token budget.
+    With "stream": true the answer is sent as newline delimited JSON frames.
+    Answers are cached per question and context; cached answers are marked
+    with "cached": true.
+    """
+    data = request.json or {}
     question = data.get('question')
     api_key = data.get('api_key')
     provider = data.get('provider')
     model = data.get('model')
 
+    if not question:
+        return jsonify({'error': 'A question is required.'}), 400
+
+    cache_key = search_key_from_id(data.get('search_id'))
+    if cache_key is None:
+        return jsonify({'error': 'A valid search_id from /search is required.'}), 400
+
+    # Stale results are still the results the user is looking at
+    cached_response, _ = search_cache.get(cache_key)
+    if not cached_response:
+        return jsonify({'error': 'Search results expired or unknown; run the search again.'}), 404
+    search_results = cached_response.get('results', [])
+
+    ai_answerer = AIQuestionAnswerer(api_key, provider, model, search_results, question)
+    search_id = search_id_from_key(cache_key)
+    answer_key = answer_cache.key(question, ai_answerer.context, provider, model)
+    cached_answer = answer_cache.get(answer_key, question, search_id, provider, model, ai_answerer.context)
+
+    def remember(answer):
+        answer_cache.set(answer_key, {'answer': answer, 'model': ai_answerer.answered_by},
+                         question, search_id, provider, model, ai_answerer.context)
+
+    if data.get('stream'):
+        # Newline delimited JSON: "token" frames as the model produces them, then "done"
+        def generate():
+            if cached_answer:
+                yield ndjson_frame({'type': 'token', 'text': cached_answer['answer']})
+                yield ndjson_frame({'type': 'done', 'model': cached_answer['model'],
+                                    'fallback': cached_answer['model'] != model, 'cached': True})
+                return
+            try:
+                chunks = []
+                for chunk in ai_answerer.stream_answer():
+                    chunks.append(chunk)
+                    yield ndjson_frame({'type': 'token', 'text': chunk})
+                remember(''.join(chunks))
+                yield ndjson_frame({'type': 'done', 'model': ai_answerer.answered_by,
+                                    'fallback': ai_answerer.used_fallback})
+            except Exception as e:
+                app.logger.error(f"Streaming answer failed: {e}")
+                yield ndjson_frame({'type': 'error', 'error': 'An error occurred while generating the answer.',
+                                    'details': str(e)})
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if cached_answer:
+        response = {'answer': cached_answer['answer'], 'cached': True}
+        if cached_answer['model'] != model:
+            response['note'] = f"Answer generated using fallback model ({cached_answer['model']})."
+        return jsonify(response)
+
     try:
-        # First attempt to call the tool
-        ai_answerer = AIQuestionAnswerer(api_key, provider, model, 'sorted_results.json', question)
+        # The fallback model is started if the first one fails or is slow; the first answer wins
         answer = ai_answerer.answer_question()
-        return jsonify({'answer': answer})
-
     except Exception as e:
-        # Retry logic: if there's an exception, retry with a fallback model (like GPT-4)
-        try:
-            fallback_model = "gpt-4"  # Define your fallback model here
-            ai_answerer = AIQuestionAnswerer(api_key, provider, fallback_model, 'sorted_results.json', question)
-            answer = ai_answerer.answer_question()
-            return jsonify({'answer': answer, 'note': 'Answer generated using fallback model (GPT-4).'})
-
-        except Exception as fallback_error:
-            return jsonify({
-                'error': 'An error occurred while generating the answer with fallback model.',
-                'details': str(fallback_error)
-            }), 500
+        return jsonify({
+            'error': 'An error occurred while generating the answer.',
+            'details': str(e)
+        }), 500
+
+    remember(answer)
+    if ai_answerer.used_fallback:
+        return jsonify({'answer': answer, 'note': f'Answer generated using fallback model ({ai_answerer.answered_by}).'})
+    return jsonify({'answer': answer})
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from crawler import SearchEngineScraper
+from engine_health import engine_health, ENGINE_SKIPS
+from engines import engine_registry
+from hedging import hedged_get_async
+from metrics import registry, timed, FETCHED_BYTES, ENGINE_ERRORS
+from rate_limiter import rate_limiter
+from transport import create_async_client
+
+logger = logging.getLogger(__name__)
+
+# Seconds each engine may take before the search response goes out without it
+DEFAULT_DEADLINE = 20
+ENGINE_DEADLINES = {
+    'bing': 20,
+    'sogou': 20,
+    'quark': 10,
+    'mso': 10,
+    'baidu': 30,
+    'sohu': 25,
+}
+
+# Threads for blocking scrapes (browser searches, URL-only custom engines). A scrape that is still running
+# at its engine's deadline keeps its thread until it returns, so there is room for more than one search's worth.
+BLOCKING_WORKERS = int(os.environ.get('BLOCKING_WORKERS', 16))
+
+# Engines with a browser_fallback whose HTTP fast path is blocked are searched in a browser instead
+BROWSER_FALLBACK = os.environ.get('BROWSER_FALLBACK', '1') == '1'
+
+BROWSER_FALLBACKS = registry.counter(
+    'mstsearch_browser_fallbacks_total', 'Engine runs retried in a browser after their HTTP fast path was blocked',
+    ('engine',))
+
+
+class AsyncSearchEngine:
+    """
+    Runs search engine scrapes concurrently on one long-lived event loop.
+
+    HTTP engines (see engines.json) are fetched with a shared, pooled
+    httpx client from transport.py. Engines that need a browser and URL-only custom engines
+    are handed to blocking_scrape on a thread pool, as are engines with a browser fallback
+    (Baidu, Sohu) when every result page was an anti-bot page. Every engine gets its own
+    deadline; engines that miss it contribute whatever they had collected.
+    Engines whose circuit breaker is open are skipped, and unreliable or slow
+    engines are asked for fewer results (see engine_health.py).
+    With parallel_pages, all result pages of multi-page engines are fetched
+    concurrently instead of one after another.
+
+    blocking_scrape(engine, keyword, max_results, stop_at) runs on a thread
+    and cannot be cancelled, so it is given the time.monotonic() deadline
+    of its engine and should stop (returning what it has) once it passes.
+    """
+
+    def __init__(self, blocking_scrape, max_workers=BLOCKING_WORKERS, deadlines=None, parallel_pages=True):
+        self.blocking_scrape = blocking_scrape
+        self.parallel_pages = parallel_pages
+        self.max_workers = max_workers
+        self.deadlines = dict(ENGINE_DEADLINES, **(deadlines or {}))
+        self.loop = None
+        self.client = None
+        self.executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the event loop thread and the shared HTTP client (idempotent)."""
+        with self._lock:
+            if self.loop is not None:
+                return
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self.loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._run_loop, name="search-event-loop", daemon=True)
+            thread.start()
+            asyncio.run_coroutine_threadsafe(self._create_client(), self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _create_client(self):
+        # Same pools, HTTP/2, TLS and DNS settings as the synchronous crawlers
+        self.client = create_async_client()
+
+    def search(self, engines, keyword):
+        """
+        Scrape all engines concurrently.
+
+        :param engines: Engine dictionaries from the /search request (name, resultsCount).
+        :param keyword: The search keyword.
+        :return: List of (engine, results) tuples in the order of engines.
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._search(engines, keyword), self.loop)
+        return future.result()
+
+    def iter_search(self, engines, keyword):
+        """Yield (engine, results) for each engine as soon as it finishes or reaches its deadline."""
+        self.start()
+        completed = queue.Queue()
+        for engine in engines:
+            future = asyncio.run_coroutine_threadsafe(self._scrape_with_deadline(engine, keyword), self.loop)
+            future.add_done_callback(completed.put)
+        for _ in engines:
+            yield completed.get().result()
+
+    async def _search(self, engines, keyword):
+        return await asyncio.gather(*(self._scrape_with_deadline(engine, keyword) for engine in engines))
+
+    def get_deadline(self, name):
+        if isinstance(name, str):
+            return self.deadlines.get(name.lower(), DEFAULT_DEADLINE)
+        return DEFAULT_DEADLINE
+
+    async def _scrape_with_deadline(self, engine, keyword):
+        name = engine.get('name')
+        max_results = engine.get('resultsCount', 10)
+        label = name.lower() if isinstance(name, str) else 'custom'
+        deadline = self.get_deadline(name)
+        results = []
+        # Custom engines registered by URL only are not tracked
+        tracked = isinstance(name, str)
+        if tracked:
+            if not engine_health.allow(label):
+                logger.info(f"Skipping {name}: its circuit breaker is open")
+                ENGINE_SKIPS.inc(engine=label, reason='open')
+                return engine, results
+            max_results = engine_health.result_budget(label, max_results, deadline)
+
+        started = time.monotonic()
+        outcome = 'ok'
+        with timed('engine', label):
+            try:
+                await asyncio.wait_for(self._scrape(engine, keyword, max_results, results, started + deadline), deadline)
+            except asyncio.TimeoutError:
+                logger.warning(f"Deadline exceeded for {name}; returning {len(results)} results collected in time")
+                ENGINE_ERRORS.inc(engine=label, kind='timeout')
+                outcome = 'slow' if results else 'timeout'
+            except Exception as e:
+                logger.error(f"Error scraping {name}: {e}")
+                ENGINE_ERRORS.inc(engine=label, kind='error')
+                outcome = 'error'
+        if tracked:
+            engine_health.record(label, started, outcome if results or outcome != 'ok' else 'empty', len(results))
+        return engine, results
+
+    async def _scrape(self, engine, keyword, max_results, results, stop_at):
+        name = engine.get('name')
+        if engine_registry.is_http_engine(name):
+            started = time.monotonic()
+            await self._scrape_http(name.lower(), keyword, max_results, results)
+            if results or not self.needs_browser(name.lower(), started):
+                return
+            logger.info(f"{name} blocked the HTTP search; falling back to the browser")
+            BROWSER_FALLBACKS.inc(engine=name.lower())
+        engine_results = await self.loop.run_in_executor(
+            self.executor, self.blocking_scrape, engine, keyword, max_results, stop_at)
+        results.extend(engine_results or [])
+
+    @staticmethod
+    def needs_browser(engine, started):
+        """Whether engine has a browser fallback and its result pages were blocked since started."""
+        return (BROWSER_FALLBACK and engine_registry.get(engine).browser_fallback
+                and engine_health.blocked_since(engine, started))
+
+    async def _scrape_http(self, engine, keyword, max_results, results):
+        max_results = engine_registry.get(engine).cap(max_results)
+        urls = SearchEngineScraper.page_urls(engine, keyword, max_results)
+
+        if self.parallel_pages and len(urls) > 1:
+            # Page offsets are deterministic, so every page is requested at once
+            # within the host's rate budget and merged back in page order.
+            pages = [[] for _ in urls]
+
+            async def fetch(index, url):
+                pages[index] = await self._fetch_page(engine, index + 1, url)
+
+            try:
+                await asyncio.gather(*(fetch(index, url) for index, url in enumerate(urls)))
+            finally:
+                results.extend(SearchEngineScraper.merge_pages(pages, max_results))
+            return
+
+        for page, url in enumerate(urls, start=1):
+            if len(results) >= max_results:
+                break
+            page_results = await self._fetch_page(engine, page, url)
+            results.extend(page_results[:max_results - len(results)])
+
+    async def _fetch_page(self, engine, page, url):
+        try:
+            await rate_limiter.wait_async(url, engine)
+            with timed('fetch', engine):
+                # A page still loading after the engine's usual (p90) latency gets a second request
+                headers = SearchEngineScraper.get_engine_headers(engine)
+                response = await hedged_get_async(
+                    engine,
+                    lambda: self.client.get(url, headers=headers),
+                    lambda: self.client.get(url, headers=SearchEngineScraper.get_hedge_headers(engine, headers)),
+                    lambda: rate_limiter.try_reserve(url, engine),
+                )
+            FETCHED_BYTES.inc(len(response.content), engine=engine)
+            logger.info(f"Received status code {response.status_code} from {engine}")
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error(f"Error accessing {engine} on page {page}: {e}")
+            ENGINE_ERRORS.inc(engine=engine, kind='error')
+            engine_health.note_failure(engine, 'error')
+            return []
+
+        if not response.text:
+            logger.warning(f"Failed to get content for {engine} page {page}. Skipping.")
+            return []
+
+        # Parse off the loop thread so other engines' I/O is not stalled
+        return await self.loop.run_in_executor(None, SearchEngineScraper.parse_page, engine, response.text, url)
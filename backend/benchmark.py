@@ -0,0 +1,324 @@
+"""
+Offline benchmarks for parsing, cleaning and ranking.
+
+Raw engine responses are recorded once into the fixture store
+(debug_responses/<engine>_page_<n>.html) and replayed from there, so runs
+need no network access and are comparable between commits:
+
+    python benchmark.py record --query 你好 --engines bing sogou quark mso baidu sohu
+    python benchmark.py run --repeat 30 --output bench.json
+    python benchmark.py run --baseline bench.json
+
+Only the Sogou result page (sogou_page_1.html) ships with the repository,
+so out of the box the parse benchmark covers Sogou alone and enrichment is
+replayed from that page; the other engines are parsed only once their
+pages have been recorded. Run results list the engines that were skipped.
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import re
+import statistics
+import time
+import zlib
+from contextlib import contextmanager
+from urllib.parse import quote
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'debug_responses')
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sorted_results.json')
+RESULT_COUNTS = (10, 50, 100, 200)
+
+
+class FixtureStore:
+    """Raw engine responses on disk, one file per engine and result page."""
+
+    def __init__(self, directory=FIXTURE_DIR):
+        self.directory = directory
+
+    def path(self, engine, page):
+        return os.path.join(self.directory, f"{engine}_page_{page}.html")
+
+    def record(self, engine, page, content):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(engine, page), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def load(self, engine):
+        """Return the recorded pages of engine in page order."""
+        pages = []
+        for path in glob.glob(os.path.join(self.directory, f"{engine}_page_*.html")):
+            match = re.search(r'_page_(\d+)\.html$', path)
+            if match:
+                with open(path, encoding='utf-8') as f:
+                    pages.append((int(match.group(1)), f.read()))
+        return [content for _, content in sorted(pages)]
+
+
+class ReplayResponse:
+    def __init__(self, url, content):
+        self.url = url
+        self.text = content
+        self.content = content.encode('utf-8')
+        self.status_code = 200
+        self.is_redirect = False
+        self.headers = {'Content-Type': 'text/html; charset=utf-8'}
+        self.charset_encoding = 'utf-8'
+
+    def raise_for_status(self):
+        pass
+
+    def iter_bytes(self, chunk_size=None):
+        chunk_size = chunk_size or len(self.content)
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class ReplayClient:
+    """Stands in for the shared HTTP client and answers every URL with a recorded page."""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, **kwargs):
+        # crc32 rather than hash(), which is salted per process, so every run replays the same page per URL
+        return ReplayResponse(url, self.pages[zlib.crc32(url.encode('utf-8')) % len(self.pages)])
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        yield self.get(url)
+
+
+def record(store, query, engines, pages, rendered=False):
+    """
+    Fetch live result pages for query and save them into the fixture store.
+
+    With rendered, Baidu and Sohu are also recorded as their browser fallbacks
+    see them (as <engine>_browser).
+    """
+    from crawler import SearchEngineScraper
+    from engines import engine_registry
+
+    scraper = SearchEngineScraper()
+    for engine in engines:
+        if rendered and engine in ('baidu', 'sohu'):
+            record_rendered(store, engine, query, pages)
+        if engine_registry.is_http_engine(engine):
+            urls = SearchEngineScraper.page_urls(engine, query, pages * 10)
+            for page, url in enumerate(urls, start=1):
+                response = scraper.client.get(url, headers=SearchEngineScraper.get_engine_headers(engine), timeout=10)
+                store.record(engine, page, response.text)
+                print(f"Recorded {engine} page {page} ({len(response.text)} characters)")
+        else:
+            print(f"Unsupported engine: {engine}")
+
+
+def record_rendered(store, engine, query, pages):
+    """Record the HTML the browser fallbacks of Baidu and Sohu see, using their driver pools."""
+    if engine == 'baidu':
+        from BaiduCrawler import BaiduScraper
+        pool = BaiduScraper().pool
+        urls = [f"https://www.baidu.com/s?wd={quote(query)}&pn={10 * page}" for page in range(pages)]
+    else:
+        from SohuCrawler import SohuCrawler
+        pool = SohuCrawler().pool
+        urls = [f"https://search.sohu.com/?keyword={quote(query)}"]
+
+    try:
+        with pool.driver() as pooled:
+            for page, url in enumerate(urls, start=1):
+                pooled.driver.get(url)
+                time.sleep(1)  # Let scripts render the results
+                pooled.pages += 1
+                store.record(f"{engine}_browser", page, pooled.driver.page_source)
+                print(f"Recorded {engine} page {page}")
+    finally:
+        pool.close()
+
+
+def measure(fn, repeat, warmup=2, setup=None):
+    """Run fn repeat times and return its latencies in milliseconds."""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        try:
+            fn()
+        finally:
+            timings.append((time.perf_counter() - start) * 1000)
+            gc.enable()
+    return timings
+
+
+def summarize(name, timings, **extra):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return dict(name=name, median_ms=round(statistics.median(ordered), 3), p95_ms=round(p95, 3),
+                runs=len(ordered), **extra)
+
+
+def distinct_url(url, copy):
+    """url with a query parameter that tells copy apart; redirect wrappers are replaced by their target."""
+    from canonicalize import embedded_target
+
+    if copy == 0:
+        return url
+    url = embedded_target(url) or url
+    return f"{url}{'&' if '?' in url else '?'}copy={copy}"
+
+
+def make_results(count):
+    """
+    Build count realistic results by cycling through the bundled ranked results.
+
+    Every cycle after the first gets its own URLs and mixes in the snippet of
+    another result, so canonicalization does not collapse the copies and
+    larger counts mean more distinct results to clean and rank.
+    """
+    with open(RESULTS_FILE, encoding='utf-8') as f:
+        base = json.load(f)
+    results = []
+    for i in range(count):
+        source = base[i % len(base)]
+        copy = i // len(base)
+        content = source['content']
+        if copy:
+            content = f"{content} {base[(i + 7 * copy) % len(base)]['content']}"
+        results.append({
+            'engine_name': source.get('engine_name', 'Bing'),
+            'title': f"{source['title']} {i}",
+            'URL': distinct_url(source['URL'], copy),
+            # A third of the results arrive without a snippet and need enrichment
+            'content': '' if i % 3 == 0 else content,
+        })
+    return results
+
+
+def bench_parsers(store, repeat):
+    from engines import engine_registry
+
+    parsers = [(definition.name, definition.parser) for definition in engine_registry]
+    parsers += [(f"{definition.name}_browser", definition.browser_parser) for definition in engine_registry
+                if definition.browser_fallback]
+    rows, missing = [], []
+    for engine, parser in parsers:
+        pages = store.load(engine)
+        if not pages:
+            missing.append(engine)
+            continue
+        total_bytes = sum(len(page.encode('utf-8')) for page in pages)
+        timings = measure(lambda: [parser.parse(page) for page in pages], repeat)
+        median_s = statistics.median(timings) / 1000
+        rows.append(summarize(f"parse:{engine}", timings, pages=len(pages),
+                              pages_per_s=round(len(pages) / median_s, 1),
+                              mb_per_s=round(total_bytes / median_s / 1e6, 2)))
+    if missing:
+        print(f"Not parsed, no fixtures in {store.directory}: {', '.join(missing)}")
+    return rows
+
+
+def bench_cleaner(store, repeat):
+    import process_result
+    from cache import TTLCache
+
+    pages = [page for engine in ('sogou', 'bing', 'baidu', 'sohu') for page in store.load(engine)]
+    if not pages:
+        print("Skipping cleaning: no fixtures to replay enrichment pages from")
+        return []
+
+    rows = []
+    for count in RESULT_COUNTS:
+        results = make_results(count)
+        cleaner = process_result.JsonCleaner()
+        cleaner.client = ReplayClient(pages)
+        cleaner.canonicalizer.resolve_redirects = False  # Opaque redirects need the network
+
+        def reset():
+            cleaner.cache = TTLCache()  # Measure real extraction, not cache hits
+
+        timings = measure(lambda: cleaner.clean_json_data([dict(result) for result in results]), repeat,
+                          setup=reset)
+        # Results left after collapsing duplicates; only these are enriched and ranked
+        rows.append(summarize(f"clean:{count}", timings, results=count, kept=cleaner.stats['kept']))
+    return rows
+
+
+def bench_ranking(repeat):
+    import sort
+
+    rows = []
+    for count in RESULT_COUNTS:
+        results = [dict(result, content=result['content'] or result['title']) for result in make_results(count)]
+        timings = measure(lambda: sort.Sort(results, "Python 教程").run_sorting(), repeat,
+                          setup=sort.token_cache.clear)
+        rows.append(summarize(f"rank:{count}", timings, results=count))
+    return rows
+
+
+def report(rows, baseline=None):
+    previous = {row['name']: row for row in baseline or []}
+    print(f"{'benchmark':<16}{'median ms':>12}{'p95 ms':>12}{'change':>10}  details")
+    for row in rows:
+        details = {key: value for key, value in row.items() if key not in ('name', 'median_ms', 'p95_ms', 'runs')}
+        change = ''
+        if row['name'] in previous and previous[row['name']]['median_ms']:
+            change = f"{(row['median_ms'] / previous[row['name']]['median_ms'] - 1) * 100:+.1f}%"
+        print(f"{row['name']:<16}{row['median_ms']:>12.3f}{row['p95_ms']:>12.3f}{change:>10}  {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help="record live engine responses into the fixture store")
+    record_parser.add_argument('--query', default="你好")
+    record_parser.add_argument('--engines', nargs='+', default=['bing', 'sogou', 'quark', 'mso', 'baidu', 'sohu'])
+    record_parser.add_argument('--pages', type=int, default=1)
+    record_parser.add_argument('--rendered', action='store_true',
+                               help="also record the pages the Baidu and Sohu browser fallbacks see")
+
+    run_parser = subparsers.add_parser('run', help="run the offline benchmarks")
+    run_parser.add_argument('--repeat', type=int, default=10)
+    run_parser.add_argument('--only', nargs='+', choices=['parse', 'clean', 'rank'], default=['parse', 'clean', 'rank'])
+    run_parser.add_argument('--output', help="write the results as JSON")
+    run_parser.add_argument('--baseline', help="JSON output of an earlier run to compare medians against")
+
+    for subparser in (record_parser, run_parser):
+        subparser.add_argument('--fixtures', default=FIXTURE_DIR)
+
+    args = parser.parse_args()
+    store = FixtureStore(args.fixtures)
+
+    if args.command == 'record':
+        record(store, args.query, args.engines, args.pages, args.rendered)
+        return
+
+    rows = []
+    if 'parse' in args.only:
+        rows += bench_parsers(store, args.repeat)
+    if 'clean' in args.only:
+        rows += bench_cleaner(store, args.repeat)
+    if 'rank' in args.only:
+        rows += bench_ranking(args.repeat)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    report(rows, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
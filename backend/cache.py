@@ -0,0 +1,227 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with a per-entry time to live and LRU eviction.
+
+    Once max_entries is reached the least recently used entry is dropped.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+SEARCH_KEY_PREFIX = "search:"
+SEARCH_ID_PATTERN = re.compile(r'[0-9a-f]{40}')
+
+
+def make_search_key(keyword, search_engines):
+    """
+    Normalized cache key for a search: the keyword plus the selected engines and their result counts.
+
+    Whitespace and case differences in the keyword and the order of the engines do not change the key.
+    """
+    normalized_keyword = ' '.join(keyword.split()).casefold()
+    engines = sorted(
+        json.dumps([engine.get('name'), engine.get('resultsCount', 10)], sort_keys=True, ensure_ascii=False)
+        for engine in search_engines if engine.get('name')
+    )
+    payload = json.dumps([normalized_keyword, engines], ensure_ascii=False)
+    return SEARCH_KEY_PREFIX + hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def search_id_from_key(cache_key):
+    """Public id of a search, handed to clients so they can refer to its cached results later."""
+    return cache_key[len(SEARCH_KEY_PREFIX):]
+
+
+def search_key_from_id(search_id):
+    """Cache key for a search id, or None if the id is malformed."""
+    if not isinstance(search_id, str) or not SEARCH_ID_PATTERN.fullmatch(search_id):
+        return None
+    return SEARCH_KEY_PREFIX + search_id
+
+
+class MemoryBackend:
+    """Per-process cache backend, mainly for development and tests."""
+
+    def __init__(self, max_entries=1000):
+        self._cache = TTLCache(max_entries=max_entries)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, fresh_until, stale_until):
+        self._cache.set(key, (value, fresh_until, stale_until), ttl=max(stale_until - time.time(), 0))
+
+
+class SQLiteBackend:
+    """
+    On-disk cache backend shared by every worker process on the host.
+
+    Values are stored as JSON. The database runs in WAL mode so readers in
+    other workers are not blocked while one worker writes. With max_entries,
+    the periodic purge also drops the entries that expire first once the
+    table grows beyond that size.
+    """
+
+    PURGE_EVERY = 100
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, fresh_until, stale_until FROM cache WHERE key = ? AND stale_until > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, key, value, fresh_until, stale_until):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), fresh_until, stale_until),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM cache WHERE stale_until <= ?", (time.time(),))
+                if self.max_entries:
+                    conn.execute(
+                        "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stale_until "
+                        "LIMIT max((SELECT count(*) FROM cache) - ?, 0))",
+                        (self.max_entries,),
+                    )
+
+
+class SearchCache:
+    """
+    Stale-while-revalidate cache in front of a pluggable backend.
+
+    Entries are fresh for fresh_ttl seconds and may then be served stale for
+    up to stale_ttl seconds while revalidate() refreshes them in the background.
+    """
+
+    def __init__(self, backend, fresh_ttl=300, stale_ttl=3600):
+        self.backend = backend
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (value, is_stale), or (None, False) on a miss."""
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+        self.hits += 1
+        value, fresh_until, _ = entry
+        return value, fresh_until <= time.time()
+
+    def set(self, key, value):
+        now = time.time()
+        self.backend.set(key, value, now + self.fresh_ttl, now + self.fresh_ttl + self.stale_ttl)
+
+    def revalidate(self, key, refresh):
+        """
+        Run refresh() on a background thread unless a refresh of key is already running.
+
+        refresh() recomputes the value and stores it itself (e.g. through a
+        single-flight that writes the cache), so it is only written once.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key, refresh), daemon=True).start()
+
+    def _refresh(self, key, refresh):
+        try:
+            refresh()
+        except Exception as e:
+            logger.warning(f"Background refresh of {key} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+def create_search_cache():
+    """Build the search cache configured by SEARCH_CACHE_BACKEND (sqlite or memory)."""
+    fresh_ttl = int(os.environ.get('SEARCH_CACHE_TTL', 300))
+    stale_ttl = int(os.environ.get('SEARCH_CACHE_STALE_TTL', 3600))
+    if os.environ.get('SEARCH_CACHE_BACKEND', 'sqlite') == 'memory':
+        backend = MemoryBackend()
+    else:
+        backend = SQLiteBackend(os.environ.get('SEARCH_CACHE_PATH', 'search_cache.db'))
+    return SearchCache(backend, fresh_ttl=fresh_ttl, stale_ttl=stale_ttl)
@@ -0,0 +1,301 @@
+"""
+Cross-engine result canonicalization, run before enrichment and ranking.
+
+Every result is brought to the same schema (title, URL, content), redirect
+wrappers are replaced by their targets and tracking parameters are dropped.
+Results are then collapsed when their URLs are equal after unifying mobile
+and desktop hosts, or when the SimHash fingerprints of their text are within
+a few bits of each other. Only the first result of each group is kept, so
+duplicates are neither downloaded nor ranked.
+"""
+import base64
+import hashlib
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, unquote, urlencode, urljoin, urlsplit, urlunsplit
+
+import numpy as np
+
+from cache import TTLCache
+from metrics import registry
+from sort import tokenize
+from transport import decode, fetch
+
+logger = logging.getLogger(__name__)
+
+# Opaque engine redirects are resolved with one request each, within these limits (seconds)
+RESOLVE_REDIRECTS = os.environ.get('CANONICAL_RESOLVE_REDIRECTS', '1') == '1'
+REDIRECT_TIMEOUT = 3
+REDIRECT_DEADLINE = 5
+REDIRECT_MAX_WORKERS = 8
+# Only the beginning of a redirect page is searched for a script or meta refresh target
+REDIRECT_PAGE_BYTES = 8192
+
+# Results whose fingerprints differ in at most this many of 64 bits are near-duplicates
+SIMHASH_MAX_DISTANCE = 3
+# Texts with fewer terms are too short to fingerprint reliably
+SIMHASH_MIN_TERMS = 8
+# Snippets are compared before enrichment; longer texts are only fingerprinted by their beginning
+SIMHASH_TEXT_CHARS = 1000
+SIMHASH_BANDS = 4  # SIMHASH_MAX_DISTANCE + 1, so near-duplicates always share a band
+
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'yclid', 'dclid', 'igshid', 'spm', 'scm', 'mc_cid', 'mc_eid',
+                   '_hsenc', '_hsmi', 'ref_src'}
+TRACKING_PREFIXES = ('utm_',)
+
+# Host prefixes that serve the same pages as the bare host
+HOST_PREFIXES = ('www.', 'm.', 'wap.', 'mobile.')
+
+# Result fields used by some crawlers, by their name in the common schema
+FIELD_ALIASES = {
+    'URL': ('link', 'url', 'href'),
+    'content': ('description', 'snippet', 'abstract'),
+}
+
+JS_REDIRECT_PATTERN = re.compile(
+    r'''(?:location\.replace\(|location\.href\s*=|location\s*=|URL=)\s*['"]?(https?://[^'"\s)>]+)''', re.IGNORECASE)
+
+
+def decode_bing(value):
+    # Bing's /ck/a wrapper carries the target as "a1" + unpadded URL-safe base64
+    if not value.startswith('a1'):
+        return None
+    encoded = value[2:]
+    try:
+        return base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+# Redirect wrappers that carry their target in a query parameter: host -> (path, parameter, decoder)
+EMBEDDED_REDIRECTS = {
+    'www.bing.com': ('/ck/a', 'u', decode_bing),
+    'cn.bing.com': ('/ck/a', 'u', decode_bing),
+    'm.so.com': ('/jump', 'u', None),
+    'www.so.com': ('/link', 'url', None),
+}
+
+# Redirect wrappers whose target only the engine knows: host -> path
+OPAQUE_REDIRECTS = {
+    'www.baidu.com': '/link',
+    'm.baidu.com': '/from',
+    'www.sogou.com': '/link',
+    'm.sogou.com': '/link',
+}
+
+CANONICAL_RESULTS = registry.counter(
+    'mstsearch_canonical_results_total',
+    'Results seen by canonicalization by outcome (input, kept, duplicate, near_duplicate, invalid)', ('outcome',))
+CANONICAL_REDIRECTS = registry.counter(
+    'mstsearch_canonical_redirects_total', 'Redirect wrappers replaced by their target', ('kind',))
+# Opaque redirect targets keyed by wrapper URL
+redirect_cache = TTLCache(max_entries=5000, ttl=86400)
+registry.register_cache('redirect', lambda: (redirect_cache.hits, redirect_cache.misses))
+
+
+def embedded_target(url):
+    """Target of a redirect wrapper that carries it in the URL, or None."""
+    parts = urlsplit(url)
+    wrapper = EMBEDDED_REDIRECTS.get(parts.hostname or '')
+    if wrapper is None or not parts.path.startswith(wrapper[0]):
+        return None
+    path, parameter, decoder = wrapper
+    value = dict(parse_qsl(parts.query)).get(parameter)
+    if not value:
+        return None
+    target = decoder(value) if decoder else unquote(value)
+    return target if target and target.startswith(('http://', 'https://')) else None
+
+
+def is_opaque_redirect(url):
+    parts = urlsplit(url)
+    path = OPAQUE_REDIRECTS.get(parts.hostname or '')
+    return path is not None and parts.path.startswith(path)
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def clean_url(url):
+    """Drop tracking parameters, the fragment and default ports; lowercase scheme and host."""
+    parts = urlsplit(url.strip())
+    query = parts.query
+    params = parse_qsl(query, keep_blank_values=True)
+    if any(is_tracking_param(name) for name, _ in params):
+        query = urlencode([(name, value) for name, value in params if not is_tracking_param(name)])
+    netloc = (parts.hostname or '').lower()
+    if parts.port and (parts.scheme, parts.port) not in (('http', 80), ('https', 443)):
+        netloc += f':{parts.port}'
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', query, ''))
+
+
+def dedupe_key(url):
+    """Key under which mobile and desktop, http and https variants of a page are equal."""
+    parts = urlsplit(url)
+    host = parts.netloc
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+    return f"{host}{parts.path.rstrip('/')}?{query}"
+
+
+def normalize_result(result):
+    """Map crawler specific field names onto title/URL/content; returns None without a usable URL."""
+    for field, aliases in FIELD_ALIASES.items():
+        if not result.get(field):
+            for alias in aliases:
+                if result.get(alias):
+                    result[field] = result.pop(alias)
+                    break
+        for alias in aliases:
+            result.pop(alias, None)
+
+    url = result.get('URL')
+    if not isinstance(url, str) or not url.strip().startswith(('http://', 'https://')):
+        return None
+    for field in ('title', 'content'):
+        value = result.get(field)
+        result[field] = value.strip() if isinstance(value, str) else ''
+    if not result['title']:
+        result['title'] = f"{result.get('engine_name', 'SearchEngine')} Result"
+    return result
+
+
+def simhash(text):
+    """64-bit SimHash of the terms of text, or None if text has too few terms."""
+    terms = [term for term in tokenize(text[:SIMHASH_TEXT_CHARS].casefold()) if any(char.isalnum() for char in term)]
+    if len(terms) < SIMHASH_MIN_TERMS:
+        return None
+    hashes = np.array([int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big')
+                       for term in terms], dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    # A bit is set where more terms have it set than not
+    return sum(1 << int(i) for i in np.flatnonzero(2 * bits.sum(axis=0) > len(terms)))
+
+
+class Canonicalizer:
+    """
+    Canonicalizes and collapses the merged results of all engines.
+
+    :param client: HTTP client used to follow opaque redirects (see transport.py).
+    :param resolve_redirects: Follow opaque engine redirects (one request per URL).
+    :param max_distance: Largest SimHash distance at which results are near-duplicates.
+    """
+
+    def __init__(self, client=None, resolve_redirects=RESOLVE_REDIRECTS, max_distance=SIMHASH_MAX_DISTANCE):
+        self.client = client
+        self.resolve_redirects = resolve_redirects and client is not None
+        self.max_distance = max_distance
+        self.cache = redirect_cache
+
+    def follow(self, url):
+        """Target of an opaque redirect from its Location header or a script/meta refresh in the page."""
+        target = self.cache.get(url)
+        if target is not None:
+            return target
+        target = url
+        try:
+            response, body = fetch(url, timeout=REDIRECT_TIMEOUT, max_bytes=REDIRECT_PAGE_BYTES,
+                                   follow_redirects=False, client=self.client)
+            if response.is_redirect:
+                target = urljoin(url, response.headers['Location'])
+            else:
+                match = JS_REDIRECT_PATTERN.search(decode(response, body))
+                if match:
+                    target = match.group(1)
+        except Exception as e:
+            logger.debug(f"Could not resolve redirect {url}: {e}")
+            return url
+        self.cache.set(url, target)
+        return target
+
+    def resolve(self, urls):
+        """Map each opaque redirect URL to its target; URLs not resolved before the deadline map to themselves."""
+        resolved = {url: url for url in urls}
+        if not urls or not self.resolve_redirects:
+            return resolved
+        executor = ThreadPoolExecutor(max_workers=min(REDIRECT_MAX_WORKERS, len(urls)))
+        futures = {executor.submit(self.follow, url): url for url in urls}
+        done, _ = wait(futures, timeout=REDIRECT_DEADLINE)
+        executor.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            resolved[futures[future]] = future.result()
+        return resolved
+
+    def canonicalize(self, results, resolve_redirects=True):
+        """
+        Return (unique results, stats) for results in their original order.
+
+        :param results: Results of all engines; entries are updated in place.
+        :param resolve_redirects: Set to False to skip the requests for opaque redirects.
+        :return: The kept results and counts of what was changed and dropped.
+        """
+        stats = {'input': len(results), 'invalid': 0, 'redirects': 0, 'duplicates': 0, 'near_duplicates': 0}
+        normalized = []
+        for result in results:
+            result = normalize_result(result)
+            if result is None:
+                stats['invalid'] += 1
+                continue
+            url = result['URL'].strip()
+            target = embedded_target(url)
+            if target:
+                CANONICAL_REDIRECTS.inc(kind='embedded')
+                stats['redirects'] += 1
+                url = target
+            result['URL'] = url
+            normalized.append(result)
+
+        opaque = [result['URL'] for result in normalized if is_opaque_redirect(result['URL'])]
+        resolved = self.resolve(list(dict.fromkeys(opaque))) if resolve_redirects else {}
+
+        kept = []
+        seen = {}
+        bands = [{} for _ in range(SIMHASH_BANDS)]
+        band_bits = 64 // SIMHASH_BANDS
+        for result in normalized:
+            target = resolved.get(result['URL'], result['URL'])
+            if target != result['URL']:
+                CANONICAL_REDIRECTS.inc(kind='opaque')
+                stats['redirects'] += 1
+            result['URL'] = clean_url(target)
+
+            key = dedupe_key(result['URL'])
+            if key in seen:
+                self.merge(seen[key], result)
+                stats['duplicates'] += 1
+                continue
+
+            fingerprint = simhash(f"{result['title']} {result['content']}")
+            if fingerprint is not None:
+                parts = [fingerprint >> (i * band_bits) & ((1 << band_bits) - 1) for i in range(SIMHASH_BANDS)]
+                original = next((candidate for i, part in enumerate(parts) for candidate in bands[i].get(part, ())
+                                 if bin(candidate[0] ^ fingerprint).count('1') <= self.max_distance), None)
+                if original is not None:
+                    self.merge(original[1], result)
+                    stats['near_duplicates'] += 1
+                    continue
+                for i, part in enumerate(parts):
+                    bands[i].setdefault(part, []).append((fingerprint, result))
+
+            seen[key] = result
+            kept.append(result)
+
+        stats['kept'] = len(kept)
+        for outcome in ('input', 'kept', 'invalid'):
+            CANONICAL_RESULTS.inc(stats[outcome], outcome=outcome)
+        CANONICAL_RESULTS.inc(stats['duplicates'], outcome='duplicate')
+        CANONICAL_RESULTS.inc(stats['near_duplicates'], outcome='near_duplicate')
+        return kept, stats
+
+    @staticmethod
+    def merge(kept, duplicate):
+        # The longer snippet may spare the kept result a download
+        if len(duplicate.get('content', '')) > len(kept.get('content', '')):
+            kept['content'] = duplicate['content']
@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:  # Memory based recycling is skipped without psutil
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Pool defaults, overridable per deployment through the environment
+DRIVER_POOL_SIZE = int(os.environ.get('DRIVER_POOL_SIZE', 2))
+DRIVER_MAX_PAGES = int(os.environ.get('DRIVER_MAX_PAGES', 50))
+DRIVER_MAX_MEMORY_GROWTH_MB = int(os.environ.get('DRIVER_MAX_MEMORY_GROWTH_MB', 300))
+DRIVER_CHECKOUT_TIMEOUT = int(os.environ.get('DRIVER_CHECKOUT_TIMEOUT', 30))
+
+
+def time_left(stop_at):
+    """Seconds until stop_at (a time.monotonic() deadline), or None without one."""
+    return None if stop_at is None else max(stop_at - time.monotonic(), 0)
+
+
+class PooledDriver:
+    """A Selenium driver together with the bookkeeping the pool needs to recycle it."""
+
+    def __init__(self, driver, baseline_memory_mb=None):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.time()
+        self.baseline_memory_mb = baseline_memory_mb
+
+
+class DriverPool:
+    """
+    Pool of Selenium drivers shared by all requests in the process.
+
+    Drivers are started on first use, or all at once by warm(), which also
+    keeps the pool full after drivers are recycled. Drivers are checked out
+    for one search and checked back in afterwards.
+    A driver is health checked before it is handed out and is recycled after
+    max_pages page loads or when its browser memory has grown by more than
+    max_memory_growth_mb since it was started.
+    """
+
+    def __init__(self, factory, name="driver", size=DRIVER_POOL_SIZE, max_pages=DRIVER_MAX_PAGES,
+                 max_memory_growth_mb=DRIVER_MAX_MEMORY_GROWTH_MB, checkout_timeout=DRIVER_CHECKOUT_TIMEOUT):
+        self.factory = factory
+        self.name = name
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_growth_mb = max_memory_growth_mb
+        self.checkout_timeout = checkout_timeout
+        self._idle = []
+        self._total = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.keep_warm = False
+
+    def warm(self):
+        """Start drivers in the background until the pool is full, and refill it after recycling from now on."""
+        self.keep_warm = True
+        threading.Thread(target=self._fill, name=f"{self.name}-pool-warmer", daemon=True).start()
+
+    def _fill(self):
+        while True:
+            with self._cond:
+                if self._closed or self._total >= self.size:
+                    return
+                self._total += 1
+            try:
+                pooled = self._create()
+            except Exception as e:
+                logger.warning(f"Could not pre-warm {self.name} driver: {e}")
+                self._release_slot()
+                return
+            self.checkin(pooled)
+
+    def _create(self):
+        start_time = time.time()
+        driver = self.factory()
+        pooled = PooledDriver(driver)
+        pooled.baseline_memory_mb = self._memory_mb(pooled)
+        logger.info(f"Started {self.name} driver in {time.time() - start_time:.2f} seconds")
+        return pooled
+
+    def _release_slot(self):
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _quit(pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logger.warning(f"Error quitting driver: {e}")
+
+    def checkout(self, timeout=None):
+        """Borrow a healthy driver, starting one if the pool has a free slot."""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.checkout_timeout)
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError(f"{self.name} driver pool is closed")
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._total < self.size:
+                    self._total += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No {self.name} driver available after waiting")
+                self._cond.wait(remaining)
+
+        if pooled is not None and not self.is_healthy(pooled):
+            logger.info(f"Replacing unhealthy {self.name} driver")
+            self._quit(pooled)
+            pooled = None
+
+        if pooled is None:
+            try:
+                pooled = self._create()
+            except Exception:
+                self._release_slot()
+                raise
+        return pooled
+
+    def checkin(self, pooled, discard=False):
+        """Return a driver to the pool, quitting it instead if it is broken or due for recycling."""
+        if discard or self._closed or self.should_recycle(pooled):
+            self._quit(pooled)
+            self._release_slot()
+            if not self._closed and self.keep_warm:
+                self.warm()  # Keep a pre-warmed pool full after recycling
+            return
+
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """Context manager that checks a driver out and always checks it back in."""
+        pooled = self.checkout(timeout)
+        discard = False
+        try:
+            yield pooled
+        except Exception:
+            discard = not self.is_healthy(pooled)
+            raise
+        finally:
+            self.checkin(pooled, discard=discard)
+
+    @staticmethod
+    def is_healthy(pooled):
+        try:
+            pooled.driver.current_url  # Cheap round trip to the browser
+            return True
+        except Exception:
+            return False
+
+    def should_recycle(self, pooled):
+        if pooled.pages >= self.max_pages:
+            return True
+        if pooled.baseline_memory_mb is not None:
+            memory_mb = self._memory_mb(pooled)
+            if memory_mb is not None and memory_mb - pooled.baseline_memory_mb > self.max_memory_growth_mb:
+                return True
+        return False
+
+    @staticmethod
+    def _memory_mb(pooled):
+        """Resident memory of the chromedriver process and the browser processes it started."""
+        if psutil is None:
+            return None
+        try:
+            process = psutil.Process(pooled.driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+        except Exception:
+            return None
+
+    def stats(self):
+        with self._cond:
+            return {'size': self.size, 'started': self._total, 'idle': len(self._idle)}
+
+    def close(self):
+        """Quit all idle drivers; drivers still checked out are quit when they are returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._quit(pooled)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_driver_pool(name, factory, **kwargs):
+    """Return the process wide pool called name, creating it with factory on first use."""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None or pool._closed:
+            pool = DriverPool(factory, name=name, **kwargs)
+            _pools[name] = pool
+        return pool
@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Rolling window of recent engine runs: at most HEALTH_WINDOW_SIZE runs from the last HEALTH_WINDOW seconds
+HEALTH_WINDOW = int(os.environ.get('ENGINE_HEALTH_WINDOW', 600))
+HEALTH_WINDOW_SIZE = 50
+# The breaker opens after this many failed runs in a row, or at this failure rate over enough runs
+FAILURE_THRESHOLD = 3
+FAILURE_RATE_THRESHOLD = 0.5
+MIN_RUNS = 6
+# Seconds an open breaker skips the engine; doubled after every failed probe
+OPEN_SECONDS = float(os.environ.get('ENGINE_BREAKER_OPEN_SECONDS', 60))
+MAX_OPEN_SECONDS = 900
+# A probe that has not reported back after this long no longer blocks the next one
+PROBE_TIMEOUT = 60
+# Engines that fail this often or whose p90 latency comes this close to their deadline
+# are asked for one page of results only
+DEGRADED_FAILURE_RATE = 0.25
+DEGRADED_LATENCY_SHARE = 0.8
+DEGRADED_RESULTS = 10
+
+# Outcomes of an engine run; timeouts that still brought results count as "slow", not failed
+FAILURES = ('timeout', 'error', 'blocked')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+ENGINE_SKIPS = registry.counter(
+    'mstsearch_engine_skips_total', 'Engine runs skipped or cut down by their circuit breaker', ('engine', 'reason'))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+class EngineHealth:
+    """Rolling run statistics and circuit breaker state of one engine."""
+
+    def __init__(self):
+        self.runs = deque(maxlen=HEALTH_WINDOW_SIZE)  # (finished at, seconds, outcome, results)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_seconds = OPEN_SECONDS
+        self.opened_at = None
+        self.probe_started = None
+        self.last_failure = (0.0, None)  # (time, kind) of the last failed page fetch
+
+    def recent(self, now):
+        while self.runs and self.runs[0][0] < now - HEALTH_WINDOW:
+            self.runs.popleft()
+        return self.runs
+
+    def failure_rate(self, runs):
+        return sum(run[2] in FAILURES for run in runs) / len(runs) if runs else 0.0
+
+    def snapshot(self, now):
+        runs = self.recent(now)
+        latencies = [round(run[1], 3) for run in runs]
+        outcomes = {}
+        for run in runs:
+            outcomes[run[2]] = outcomes.get(run[2], 0) + 1
+        return {
+            'state': self.state,
+            'runs': len(runs),
+            'outcomes': outcomes,
+            'failure_rate': round(self.failure_rate(runs), 3),
+            'p50_seconds': percentile(latencies, 0.5),
+            'p90_seconds': percentile(latencies, 0.9),
+            'results_per_run': round(sum(run[3] for run in runs) / len(runs), 1) if runs else None,
+            'retry_in': round(max(self.opened_at + self.open_seconds - now, 0), 1) if self.state == OPEN else None,
+        }
+
+
+class EngineHealthRegistry:
+    """
+    Per-engine health shared by every search in the process.
+
+    Each engine run reports its latency, outcome and result count. After
+    FAILURE_THRESHOLD failures in a row, or a failure rate of at least
+    FAILURE_RATE_THRESHOLD over MIN_RUNS recent runs, the engine's breaker
+    opens and searches skip the engine. Once the open period has passed one
+    search probes the engine (half-open): success closes the breaker, failure
+    opens it again for twice as long. Engines that are unreliable or slow but
+    not open are only asked for DEGRADED_RESULTS results.
+    """
+
+    def __init__(self):
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def _health(self, engine):
+        return self._engines.setdefault(engine.lower(), EngineHealth())
+
+    def allow(self, engine):
+        """Whether a search may run engine now; the first caller after the open period becomes the probe."""
+        now = time.monotonic()
+        with self._lock:
+            health = self._health(engine)
+            if health.state == CLOSED:
+                return True
+            if health.state == OPEN and now - health.opened_at < health.open_seconds:
+                return False
+            if health.state == HALF_OPEN and now - health.probe_started < PROBE_TIMEOUT:
+                return False
+            health.state = HALF_OPEN
+            health.probe_started = now
+        logger.info(f"Probing {engine} after its circuit breaker was open")
+        return True
+
+    def result_budget(self, engine, requested, deadline):
+        """Results to ask engine for: all of requested, or DEGRADED_RESULTS while it is unreliable or slow."""
+        now = time.monotonic()
+        with self._lock:
+            health = self._health(engine)
+            runs = health.recent(now)
+            if health.state != CLOSED or len(runs) < FAILURE_THRESHOLD:
+                return requested
+            p90 = percentile([run[1] for run in runs], 0.9)
+            degraded = (health.failure_rate(runs) >= DEGRADED_FAILURE_RATE
+                        or p90 >= DEGRADED_LATENCY_SHARE * deadline)
+        if degraded and requested > DEGRADED_RESULTS:
+            ENGINE_SKIPS.inc(engine=engine.lower(), reason='degraded')
+            return DEGRADED_RESULTS
+        return requested
+
+    def note_failure(self, engine, kind):
+        """Called when a result page of engine could not be fetched ("error") or was an anti-bot page ("blocked")."""
+        with self._lock:
+            self._health(engine).last_failure = (time.monotonic(), kind)
+
+    def blocked_since(self, engine, started):
+        """Whether a result page of engine was an anti-bot page since started (time.monotonic())."""
+        with self._lock:
+            failed_at, kind = self._health(engine).last_failure
+        return kind == 'blocked' and failed_at >= started
+
+    def record(self, engine, started, outcome, results):
+        """
+        Record one finished run of engine.
+
+        :param started: time.monotonic() when the run started.
+        :param outcome: "ok", "slow" (deadline hit with results), "timeout", "error" or "empty".
+        :param results: Number of results the run yielded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            health = self._health(engine)
+            # A run that came back empty because its pages failed is a failure, not a query without results
+            failed_at, kind = health.last_failure
+            if outcome == 'empty' and failed_at >= started:
+                outcome = kind
+            health.runs.append((now, now - started, outcome, results))
+
+            if outcome not in FAILURES:
+                if health.state != CLOSED:
+                    logger.info(f"Closing the circuit breaker of {engine}")
+                health.state = CLOSED
+                health.consecutive_failures = 0
+                health.open_seconds = OPEN_SECONDS
+                return
+
+            health.consecutive_failures += 1
+            runs = health.recent(now)
+            if health.state == HALF_OPEN:
+                health.open_seconds = min(health.open_seconds * 2, MAX_OPEN_SECONDS)
+            elif not (health.consecutive_failures >= FAILURE_THRESHOLD
+                      or (len(runs) >= MIN_RUNS and health.failure_rate(runs) >= FAILURE_RATE_THRESHOLD)):
+                return
+            health.state = OPEN
+            health.opened_at = now
+        logger.warning(f"Circuit breaker of {engine} open for {health.open_seconds:.0f}s after {outcome}")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {engine: health.snapshot(now) for engine, health in self._engines.items()}
+
+
+# Process wide engine health shared by the sync and async crawlers
+engine_health = EngineHealthRegistry()
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import threading
+import urllib.parse
+
+from lxml import etree
+
+from parsers import JsonResultParser, ResultParser
+
+logger = logging.getLogger(__name__)
+
+# Built-in engine definitions; override the location with ENGINES_FILE
+ENGINES_FILE = os.environ.get(
+    'ENGINES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'engines.json'))
+
+PAGINATION_TYPES = ('none', 'page', 'offset')
+PARSERS = {'html': ResultParser, 'json': JsonResultParser}
+# Selectors holding a list of strings; a single string is taken as a list of one
+LIST_SELECTOR_KEYS = ('results', 'title', 'url', 'content', 'required', 'block_markers')
+SELECTOR_KEYS = ('results', 'title', 'url', 'content', 'required', 'defaults',
+                 'container_start', 'container_end', 'block_markers')
+
+MOBILE_USER_AGENT = ("Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15 "
+                     "(KHTML, like Gecko) Version/14.0 Mobile/15A5341f Safari/604.1")
+
+
+class EngineDefinition:
+    """
+    A search engine described by data instead of code.
+
+    The URL template may use {query}, {page} (1, 2, ...) and {offset}
+    (offset_start, offset_start + page_size, ...). Pagination is "page",
+    "offset" or "none" for engines that only have a single result page.
+    The format is "html" (XPath selectors) or "json" for search endpoints
+    answering with JSON (dotted path selectors); the selectors are compiled
+    once into a parser. Browser engines have no URL and are only used for
+    their selectors. Engines with browser_fallback (Baidu, Sohu) are fetched
+    over plain HTTP and only searched in a browser when that is blocked;
+    browser_selectors then parse the rendered page if it differs.
+    """
+
+    def __init__(self, name, selectors, url=None, pagination='none', page_size=10, offset_start=0,
+                 max_results=None, mobile=False, browser=False, resolve_urls=False, format='html',
+                 browser_fallback=False, browser_selectors=None):
+        self.name = name.lower()
+        self.url = url
+        self.pagination = pagination
+        self.page_size = page_size
+        self.offset_start = offset_start
+        self.max_results = max_results
+        self.mobile = mobile
+        self.browser = browser
+        self.resolve_urls = resolve_urls
+        self.format = format
+        self.browser_fallback = browser_fallback
+        self.selectors = selectors
+        self.parser = PARSERS[format](self.name, **selectors)
+        self.browser_parser = ResultParser(self.name, **browser_selectors) if browser_selectors else self.parser
+
+    @classmethod
+    def from_config(cls, name, config):
+        """Validate and compile a definition from its JSON form; raises ValueError when it is invalid."""
+        if not name or not isinstance(name, str):
+            raise ValueError("Engine name is required.")
+        if not isinstance(config, dict):
+            raise ValueError(f"Definition of {name} must be an object.")
+        config = dict(config)
+        selectors = cls.check_selectors(name, config.pop('selectors', None))
+        if config.get('browser_selectors') is not None:
+            config['browser_selectors'] = cls.check_selectors(name, config['browser_selectors'])
+        if config.get('format', 'html') not in PARSERS:
+            raise ValueError(f"Format of {name} must be one of {', '.join(PARSERS)}.")
+
+        if not config.get('browser'):
+            url = config.get('url')
+            if not url or '{query}' not in url:
+                raise ValueError(f"Engine {name} needs a URL template containing {{query}}.")
+            parsed_url = urllib.parse.urlparse(url)
+            if parsed_url.scheme not in ('http', 'https') or not parsed_url.netloc:
+                raise ValueError(f"Invalid URL template for {name}: {url}")
+            try:
+                url.format(query='', page=1, offset=0)
+            except (KeyError, IndexError, ValueError):
+                raise ValueError(f"URL template of {name} may only use {{query}}, {{page}} and {{offset}}.")
+        if config.get('pagination', 'none') not in PAGINATION_TYPES:
+            raise ValueError(f"Pagination of {name} must be one of {', '.join(PAGINATION_TYPES)}.")
+        for key, minimum in (('page_size', 1), ('max_results', 1), ('offset_start', 0)):
+            if key not in config or key == 'max_results' and config[key] is None:
+                continue
+            value = config[key]
+            if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+                raise ValueError(f"{key} of {name} must be an integer of at least {minimum}.")
+        for key in ('mobile', 'browser', 'resolve_urls', 'browser_fallback'):
+            if key in config and not isinstance(config[key], bool):
+                raise ValueError(f"{key} of {name} must be true or false.")
+
+        try:
+            return cls(name, selectors, **config)
+        except TypeError as e:
+            raise ValueError(f"Invalid definition for {name}: {e}")
+        except etree.XPathSyntaxError as e:
+            raise ValueError(f"Invalid selector for {name}: {e}")
+
+    @staticmethod
+    def check_selectors(name, selectors):
+        if not isinstance(selectors, dict) or not selectors.get('results'):
+            raise ValueError(f"Engine {name} needs a 'results' selector.")
+        unknown = set(selectors) - set(SELECTOR_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown selectors for {name}: {', '.join(sorted(unknown))}")
+        checked = {}
+        for key, value in selectors.items():
+            if key in LIST_SELECTOR_KEYS:
+                value = [value] if isinstance(value, str) else value
+                if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                    raise ValueError(f"Selector {key} of {name} must be a string or a list of strings.")
+            elif key == 'defaults':
+                if not isinstance(value, dict) or not all(isinstance(item, str) for item in value.values()):
+                    raise ValueError(f"Selector defaults of {name} must map fields to strings.")
+            elif value is not None and not isinstance(value, str):
+                raise ValueError(f"Selector {key} of {name} must be a string.")
+            checked[key] = value
+        return checked
+
+    def cap(self, result_number):
+        return min(result_number, self.max_results) if self.max_results else result_number
+
+    def page_urls(self, query, result_number):
+        """Return the result page URLs needed to collect result_number results."""
+        encoded_query = urllib.parse.quote(query)
+        if self.pagination == 'none':
+            return [self.url.format(query=encoded_query, page=1, offset=self.offset_start)]
+        pages = -(-self.cap(result_number) // self.page_size)
+        return [self.url.format(query=encoded_query, page=page + 1, offset=self.offset_start + page * self.page_size)
+                for page in range(pages)]
+
+    def parse(self, content, page_url=None):
+        return self.parser.parse(content, base_url=page_url if self.resolve_urls else None)
+
+
+class EngineRegistry:
+    """Thread-safe mapping of engine names to compiled definitions."""
+
+    def __init__(self):
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def load(self, path=ENGINES_FILE):
+        with open(path, encoding='utf-8') as f:
+            for name, config in json.load(f).items():
+                self.register(EngineDefinition.from_config(name, config))
+
+    def register(self, definition):
+        with self._lock:
+            self._engines[definition.name] = definition
+        logger.debug(f"Registered search engine {definition.name}")
+
+    def unregister(self, name):
+        with self._lock:
+            return self._engines.pop(name.lower(), None)
+
+    def get(self, name):
+        if not isinstance(name, str):
+            return None
+        return self._engines.get(name.lower())
+
+    def is_http_engine(self, name):
+        definition = self.get(name)
+        return definition is not None and not definition.browser
+
+    def names(self):
+        return list(self._engines)
+
+    def __iter__(self):
+        return iter(list(self._engines.values()))
+
+
+engine_registry = EngineRegistry()
+engine_registry.load()
+
+
+def parse_results(engine, content, page_url=None):
+    """Parse a result page of engine into a list of result dictionaries."""
+    definition = engine_registry.get(engine)
+    if definition is None:
+        raise ValueError(f"Unsupported search engine: {engine}")
+    return definition.parse(content, page_url)
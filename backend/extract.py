@@ -0,0 +1,103 @@
+import re
+
+from lxml import etree, html
+
+# Elements that never hold the main text of a page
+BOILERPLATE_TAGS = ('script', 'style', 'noscript', 'iframe', 'svg', 'form', 'nav', 'header', 'footer', 'aside',
+                    'button', 'select', 'template')
+# Elements whose class or id contains one of these words are page furniture
+BOILERPLATE_WORDS = {'nav', 'navbar', 'menu', 'footer', 'header', 'sidebar', 'comment', 'comments', 'breadcrumb',
+                     'ad', 'ads', 'advert', 'advertisement', 'share', 'social', 'related', 'recommend', 'copyright',
+                     'login', 'banner', 'popup', 'cookie', 'toolbar'}
+KEPT_TAGS = ('html', 'body', 'main', 'article')
+
+TEXT_BLOCK_TAGS = ('p', 'pre', 'blockquote', 'li')
+# Blocks shorter than this or made up mostly of link text are skipped
+MIN_BLOCK_CHARS = 25
+MAX_LINK_DENSITY = 0.5
+# The best scoring container must hold this share of all text, otherwise every block is used
+MIN_CONTAINER_SHARE = 0.3
+MAX_TEXT_CHARS = 5000
+
+WORD_SEPARATOR = re.compile(r'[\s_\-]+')
+WHITESPACE = re.compile(r'\s+')
+
+
+def is_boilerplate(element):
+    if element.tag in KEPT_TAGS:
+        return False
+    names = f"{element.get('class', '')} {element.get('id', '')}".lower()
+    return not BOILERPLATE_WORDS.isdisjoint(WORD_SEPARATOR.split(names))
+
+
+def text_blocks(root):
+    """(element, text) of every paragraph-like block with enough text that is not mostly links."""
+    blocks = []
+    for element in root.iter(*TEXT_BLOCK_TAGS):
+        # List items made of paragraphs are covered by those paragraphs
+        if element.tag == 'li' and element.find('.//p') is not None:
+            continue
+        text = WHITESPACE.sub(' ', element.text_content()).strip()
+        if len(text) < MIN_BLOCK_CHARS:
+            continue
+        link_chars = sum(len(link.text_content().strip()) for link in element.iter('a'))
+        if link_chars > MAX_LINK_DENSITY * len(text):
+            continue
+        blocks.append((element, text))
+    return blocks
+
+
+def main_text(markup, max_chars=MAX_TEXT_CHARS):
+    """
+    Main body text of an HTML page (or the beginning of one), at most max_chars long.
+
+    Scripts, navigation, footers and elements named like page furniture are
+    dropped. The remaining paragraphs vote for their parent (and, with half
+    weight, grandparent) by text length; the paragraphs inside the winning
+    container are returned in document order.
+    """
+    if not markup:
+        return ''
+    try:
+        try:
+            root = html.fromstring(markup)
+        except ValueError:
+            # lxml refuses text that still carries an XML encoding declaration
+            root = html.fromstring(markup.encode('utf-8'))
+    except (etree.ParserError, ValueError, AttributeError):
+        return ''
+
+    etree.strip_elements(root, *BOILERPLATE_TAGS, with_tail=False)
+    for element in list(root.iter(etree.Element)):
+        if element.getparent() is not None and is_boilerplate(element):
+            element.drop_tree()
+
+    blocks = text_blocks(root)
+    if not blocks:
+        return WHITESPACE.sub(' ', root.text_content()).strip()[:max_chars]
+
+    scores = {}
+    for element, text in blocks:
+        parent = element.getparent()
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + len(text)
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + len(text) / 2
+
+    total = sum(len(text) for _, text in blocks)
+    chosen = blocks
+    if scores:
+        best = max(scores, key=scores.get)
+        inside = [(element, text) for element, text in blocks if best in element.iterancestors()]
+        if sum(len(text) for _, text in inside) >= MIN_CONTAINER_SHARE * total:
+            chosen = inside
+
+    parts, length = [], 0
+    for _, text in chosen:
+        if length >= max_chars:
+            break
+        parts.append(text)
+        length += len(text) + 1
+    return ' '.join(parts)[:max_chars]
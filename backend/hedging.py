@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Hedge a result page fetch that has not answered within its engine's p90 fetch latency
+HEDGE_REQUESTS = os.environ.get('HEDGE_REQUESTS', '1') == '1'
+HEDGE_PERCENTILE = 0.9
+# Fetch latencies kept per engine, and how many are needed before hedging starts
+LATENCY_SAMPLES = 100
+MIN_SAMPLES = 20
+# Never hedge sooner than this (seconds), so fast engines are not doubled on jitter
+MIN_HEDGE_DELAY = 0.05
+# Global hedge budget: every fetch earns HEDGE_BUDGET_RATIO hedges, up to HEDGE_BUDGET_BURST saved up
+HEDGE_BUDGET_RATIO = float(os.environ.get('HEDGE_BUDGET_RATIO', 0.1))
+HEDGE_BUDGET_BURST = 10
+
+HEDGES = registry.counter(
+    'mstsearch_hedged_requests_total',
+    'Duplicate result page requests by outcome (won, lost, no_budget, rate_limited)', ('engine', 'outcome'))
+
+
+def hedge_delay(latencies):
+    """The HEDGE_PERCENTILE of latencies, or None with fewer than MIN_SAMPLES of them."""
+    ordered = sorted(latencies)
+    if len(ordered) < MIN_SAMPLES:
+        return None
+    return max(ordered[int(HEDGE_PERCENTILE * (len(ordered) - 1))], MIN_HEDGE_DELAY)
+
+
+class HedgePolicy:
+    """
+    Decides when a slow result page fetch gets a duplicate request.
+
+    Fetch latencies are tracked per engine; once an engine has MIN_SAMPLES of
+    them, a fetch still running after the engine's p90 may be hedged. Hedges
+    are paid for from one process-wide budget that grows by budget_ratio per
+    fetch, so hedging adds at most that share of extra requests.
+    """
+
+    def __init__(self, enabled=HEDGE_REQUESTS, budget_ratio=HEDGE_BUDGET_RATIO, burst=HEDGE_BUDGET_BURST):
+        self.enabled = enabled
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.budget = float(burst)
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def observe(self, engine, seconds):
+        """Record the latency of a completed fetch; every fetch also earns hedge budget."""
+        with self._lock:
+            self._latencies.setdefault(engine, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+            self.budget = min(self.burst, self.budget + self.budget_ratio)
+
+    def delay(self, engine):
+        """Seconds after which a fetch from engine should be hedged, or None while too little is known."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            latencies = list(self._latencies.get(engine, ()))
+        return hedge_delay(latencies)
+
+    def acquire(self, engine):
+        """Take one hedge from the global budget; False when it is used up."""
+        with self._lock:
+            if self.budget >= 1:
+                self.budget -= 1
+                return True
+        HEDGES.inc(engine=engine, outcome='no_budget')
+        return False
+
+    def refund(self):
+        """Return a hedge taken with acquire() that was not sent after all."""
+        with self._lock:
+            self.budget = min(self.burst, self.budget + 1)
+
+    def stats(self):
+        """Remaining hedge budget and the current hedge delay of every engine."""
+        with self._lock:
+            return {'budget': round(self.budget, 2),
+                    'hedge_after': {engine: hedge_delay(latencies) for engine, latencies in self._latencies.items()}}
+
+
+hedge_policy = HedgePolicy()
+
+# Runs the requests of hedged synchronous fetches; a losing request finishes here in the background
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+
+def hedged_get(engine, primary, hedge, may_hedge, policy=hedge_policy):
+    """
+    Run primary() and, if it is slow, hedge() as well; return the first successful response.
+
+    primary and hedge are blocking calls returning a response. may_hedge() is
+    asked before the duplicate is sent (e.g. for a rate limit slot). An error
+    is only raised when every request that was sent has failed.
+    """
+    start = time.perf_counter()
+    delay = policy.delay(engine)
+    if delay is None:
+        response = primary()
+        policy.observe(engine, time.perf_counter() - start)
+        return response
+
+    futures = {executor.submit(primary): 'primary'}
+    done, _ = wait(futures, timeout=delay)
+    if not done and policy.acquire(engine):
+        if may_hedge():
+            futures[executor.submit(hedge)] = 'hedge'
+        else:
+            policy.refund()
+            HEDGES.inc(engine=engine, outcome='rate_limited')
+
+    error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            policy.observe(engine, time.perf_counter() - start)
+            if len(futures) > 1:
+                HEDGES.inc(engine=engine, outcome='won' if futures[future] == 'hedge' else 'lost')
+            return future.result()
+    raise error
+
+
+async def hedged_get_async(engine, primary, hedge, may_hedge, policy=hedge_policy):
+    """Coroutine version of hedged_get(); primary and hedge return awaitables and the loser is cancelled."""
+    start = time.perf_counter()
+    delay = policy.delay(engine)
+    if delay is None:
+        response = await primary()
+        policy.observe(engine, time.perf_counter() - start)
+        return response
+
+    tasks = {asyncio.ensure_future(primary()): 'primary'}
+    pending = set(tasks)
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and policy.acquire(engine):
+            if may_hedge():
+                hedge_task = asyncio.ensure_future(hedge())
+                tasks[hedge_task] = 'hedge'
+                pending.add(hedge_task)
+            else:
+                policy.refund()
+                HEDGES.inc(engine=engine, outcome='rate_limited')
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                policy.observe(engine, time.perf_counter() - start)
+                if len(tasks) > 1:
+                    HEDGES.inc(engine=engine, outcome='won' if tasks[task] == 'hedge' else 'lost')
+                return task.result()
+        raise error
+    finally:
+        # The losing request, or every request if the caller was cancelled
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,178 @@
+import hashlib
+import importlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the first answer chunk of a streaming client before hedging with
+# the fallback model, and for the whole answer
+ANSWER_HEDGE_AFTER = float(os.environ.get('ANSWER_HEDGE_AFTER', 8))
+ANSWER_DEADLINE = float(os.environ.get('ANSWER_DEADLINE', 60))
+MAX_CLIENTS = 64
+
+# Seconds between the words of the stub provider's answer
+STUB_LLM_DELAY = float(os.environ.get('STUB_LLM_DELAY', 0))
+
+
+class StubLLM:
+    """Local provider for tests and development; answers without calling any service."""
+
+    def __init__(self, api_key=None, model='stub'):
+        self.model = model
+
+    def __call__(self, prompt):
+        return ''.join(self.stream(prompt))
+
+    def stream(self, prompt):
+        question = prompt.rsplit("Question:", 1)[-1].split("\n\nAnswer:", 1)[0].strip()
+        words = f"Stub answer from {self.model} to: {question}".split(' ')
+        for i, word in enumerate(words):
+            if STUB_LLM_DELAY:
+                time.sleep(STUB_LLM_DELAY)
+            yield word if i == 0 else ' ' + word
+
+
+# Providers implemented here instead of in a langchain-<provider> package
+BUILTIN_PROVIDERS = {'stub': StubLLM}
+
+
+class ClientRegistry:
+    """
+    Process-wide cache of provider clients keyed by (provider, model, API key hash).
+
+    Clients are created once and reused by every request, so provider module
+    imports, client setup and the clients' HTTP connection pools are shared.
+    The least recently used client is dropped when max_clients is exceeded.
+    """
+
+    def __init__(self, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(provider, model, api_key):
+        key_hash = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+        return (provider or '').lower(), model, key_hash
+
+    def get(self, provider, model, api_key):
+        key = self.key(provider, model, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+        client = self.create(provider, model, api_key)
+        with self._lock:
+            # Another thread may have created the same client meanwhile; keep the first one
+            client = self._clients.setdefault(key, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        return client
+
+    @staticmethod
+    def create(provider, model, api_key):
+        if not provider:
+            raise ValueError("An AI provider is required.")
+        builtin = BUILTIN_PROVIDERS.get(provider.lower())
+        if builtin is not None:
+            return builtin(api_key=api_key, model=model)
+        # Dynamically import the provider package
+        provider_module = importlib.import_module(f"langchain-{provider.lower()}")
+        return provider_module.LangChain(api_key=api_key, model=model)
+
+
+client_registry = ClientRegistry()
+
+# Runs model calls so a slow primary model can be hedged by the fallback model
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm")
+
+
+def stream_completion(client, prompt):
+    """Yield the answer in chunks; clients without a stream() method answer in one chunk."""
+    if hasattr(client, 'stream'):
+        yield from client.stream(prompt)
+    else:
+        yield client(prompt)
+
+
+def _pump(label, call, events, cancelled):
+    try:
+        for chunk in call():
+            if cancelled.is_set():
+                return
+            events.put((label, 'chunk', chunk))
+        events.put((label, 'done', None))
+    except Exception as e:
+        events.put((label, 'error', e))
+
+
+def race(primary, fallback=None, hedge_after=ANSWER_HEDGE_AFTER, deadline=ANSWER_DEADLINE):
+    """
+    Yield (label, chunk) from the first of two model calls to produce output.
+
+    primary and fallback are (label, call) pairs where call() returns an
+    iterator of answer chunks. The fallback starts as soon as the primary
+    fails, or if the primary has produced nothing after hedge_after seconds
+    (never with hedge_after None, for calls whose first chunk is the whole
+    answer); from then on whichever call produces a chunk first wins and the
+    other one is abandoned. Errors after the winner has started streaming are
+    raised, as is TimeoutError once deadline passes.
+    """
+    events = queue.Queue()
+    cancelled = {primary[0]: threading.Event()}
+    executor.submit(_pump, primary[0], primary[1], events, cancelled[primary[0]])
+
+    def start_fallback():
+        cancelled[fallback[0]] = threading.Event()
+        executor.submit(_pump, fallback[0], fallback[1], events, cancelled[fallback[0]])
+        logger.info(f"Hedging {primary[0]} with {fallback[0]}")
+
+    start = time.monotonic()
+    winner = None
+    failures = {}
+    try:
+        while True:
+            hedging = (fallback is not None and hedge_after is not None and fallback[0] not in cancelled
+                       and winner is None)
+            limit = hedge_after if hedging else deadline
+            try:
+                label, kind, value = events.get(timeout=max(limit - (time.monotonic() - start), 0))
+            except queue.Empty:
+                if hedging:
+                    start_fallback()
+                    continue
+                raise TimeoutError(f"No answer within {deadline} seconds")
+
+            if winner is not None and label != winner:
+                continue
+            if kind == 'error':
+                failures[label] = value
+                if winner is not None:
+                    raise value
+                if fallback is not None and fallback[0] not in cancelled:
+                    start_fallback()
+                elif len(failures) == len(cancelled):
+                    raise value
+                continue
+
+            if winner is None:
+                winner = label
+                for other, event in cancelled.items():
+                    if other != label:
+                        event.set()
+            if kind == 'done':
+                return
+            yield label, value
+    finally:
+        # Stop the losing call, and every call if the consumer went away
+        for event in cancelled.values():
+            event.set()
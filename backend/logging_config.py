@@ -0,0 +1,103 @@
+"""
+Process-wide logging setup.
+
+Request threads only put log records on a bounded queue; a background
+QueueListener formats them (as JSON lines by default) and writes them out,
+so slow stdout/stderr never blocks a search. When the queue is full new
+records are dropped and counted instead of waiting.
+
+Full result payloads are never logged per request. log_payload() emits one
+for a sampled fraction of calls (LOG_PAYLOAD_SAMPLE_RATE, default 0) and
+only at DEBUG level.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json or text
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', 0))
+
+# Attributes every LogRecord has; anything else was passed through extra=
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields plus any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        # Tracebacks are already part of the message; QueueHandler folds them in before queueing
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Route all logging through a queue to a background writer thread (idempotent)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler()
+        if log_format == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(DroppingQueueHandler(log_queue))
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        # Flush whatever is still queued on shutdown
+        atexit.register(_listener.stop)
+
+
+def log_payload(logger, message, payload, sample_rate=None):
+    """
+    Log a large payload (e.g. a result list) at DEBUG level for a sampled fraction of calls.
+
+    The payload is copied here and serialized on the listener thread, so
+    callers pay nothing unless the call is sampled.
+    """
+    rate = LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or not logger.isEnabledFor(logging.DEBUG) or random.random() >= rate:
+        return
+    if isinstance(payload, list):
+        payload = [dict(item) if isinstance(item, dict) else item for item in payload]
+    logger.debug(message, extra={'payload': payload})
@@ -0,0 +1,160 @@
+"""
+Lightweight in-process metrics rendered in the Prometheus text format.
+
+Pipeline stages are timed with timed() / timed_stage() into one latency
+histogram labelled by stage and engine. Metrics are per process; with
+several workers, scrape each one or aggregate in Prometheus.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Seconds; search stages range from sub-millisecond parses to engine deadlines
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, [('le', format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(state[-2])}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key)} {state[-1]}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._caches = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name, stats):
+        """Report a cache's hit ratio; stats() returns its (hits, misses) and is read at render time."""
+        self._caches[name] = stats
+
+    def render_caches(self):
+        rows = []
+        for name, stats in sorted(self._caches.items()):
+            hits, misses = stats()
+            rows.append((name, hits, misses, hits / (hits + misses) if hits + misses else 0.0))
+        for metric, column, kind, documentation in (
+                ('mstsearch_cache_hits_total', 1, 'counter', 'Cache lookups that found an entry'),
+                ('mstsearch_cache_misses_total', 2, 'counter', 'Cache lookups that found nothing'),
+                ('mstsearch_cache_hit_ratio', 3, 'gauge', 'Share of cache lookups that were hits')):
+            yield f"# HELP {metric} {documentation}"
+            yield f"# TYPE {metric} {kind}"
+            for row in rows:
+                yield f"{metric}{format_labels(('cache',), (row[0],))} {format_value(row[column])}"
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        lines.extend(self.render_caches())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'mstsearch_stage_seconds', 'Latency of search pipeline stages', ('stage', 'engine'))
+FETCHED_BYTES = registry.counter(
+    'mstsearch_fetched_bytes_total', 'Response bytes downloaded', ('engine',))
+ENGINE_ERRORS = registry.counter(
+    'mstsearch_engine_errors_total', 'Failed, timed out, blocked or empty engine fetches', ('engine', 'kind'))
+
+
+@contextmanager
+def timed(stage, engine=''):
+    """Record how long the block takes as stage (and engine) in the stage latency histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, engine=engine)
+
+
+def timed_stage(stage):
+    """Decorator form of timed() for functions that make up a whole stage."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,187 @@
+import json
+import logging
+import re
+from urllib.parse import urljoin
+from lxml import etree, html
+from engine_health import engine_health
+from metrics import ENGINE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+def has_class(name):
+    """XPath predicate matching elements whose class list contains name."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Selector expressions are XPath. hasclass('name') is shorthand for has_class(name)
+# and is expanded before compiling, so engine definitions stay readable.
+HASCLASS_PATTERN = re.compile(r"hasclass\('([^']+)'\)")
+
+
+def compile_xpath(expression):
+    return etree.XPath(HASCLASS_PATTERN.sub(lambda match: has_class(match.group(1)), expression))
+
+
+FIELDS = ('title', 'url', 'content')
+
+
+class ResultParser:
+    """Extracts result dictionaries from one engine's result page with precompiled XPath selectors."""
+
+    def __init__(self, engine, results, title=(), url=(), content=(), required=(), defaults=None,
+                 container_start=None, container_end=None, block_markers=()):
+        self.engine = engine
+        self.results = [compile_xpath(expression) for expression in results]
+        self.fields = {
+            'title': [compile_xpath(expression) for expression in title],
+            'url': [compile_xpath(expression) for expression in url],
+            'content': [compile_xpath(expression) for expression in content],
+        }
+        self.required = tuple(required)
+        self.defaults = dict(defaults or {})
+        self.container_start = container_start
+        self.container_end = container_end
+        self.block_markers = tuple(block_markers)
+
+    def is_blocked(self, content):
+        lowered = content.lower()
+        return any(marker in lowered for marker in self.block_markers)
+
+    def slice_container(self, content):
+        """Cut the result container out of the page; the whole page is used when the marker is missing."""
+        if not self.container_start:
+            return content
+        start = content.find(self.container_start)
+        if start == -1:
+            return content
+        start = content.rfind('<', 0, start)
+        end = content.find(self.container_end, start) if self.container_end else -1
+        return content[start:end] if end != -1 else content[start:]
+
+    @staticmethod
+    def to_tree(markup):
+        try:
+            return html.document_fromstring(markup)
+        except ValueError:  # Unicode strings with an XML encoding declaration
+            return html.document_fromstring(markup.encode('utf-8'))
+
+    def find_results(self, content):
+        """Return the result elements of the page."""
+        if not content.strip():
+            return []
+        tree = self.to_tree(self.slice_container(content))
+        for selector in self.results:
+            elements = selector(tree)
+            if elements:
+                return elements
+        return []
+
+    def extract_field(self, element, field):
+        for selector in self.fields[field]:
+            matches = selector(element)
+            if matches:
+                match = matches[0]
+                value = match.text_content() if hasattr(match, 'text_content') else str(match)
+                return value.strip()
+        return None
+
+    def extract(self, element, base_url=None):
+        """Extract one result; returns None when a required field is missing."""
+        values = {field: self.extract_field(element, field) for field in FIELDS}
+        if any(not values[field] for field in self.required):
+            return None
+        if base_url and values['url']:
+            values['url'] = urljoin(base_url, values['url'])
+        return {
+            "engine_name": self.engine.capitalize(),
+            "title": values['title'] if values['title'] is not None else self.defaults.get('title', ""),
+            "content": values['content'] if values['content'] is not None else self.defaults.get('content', ""),
+            "URL": values['url'] if values['url'] is not None else self.defaults.get('url', ""),
+        }
+
+    def parse(self, content, base_url=None):
+        """
+        Parse a result page into result dictionaries.
+
+        :param content: The page HTML.
+        :param base_url: If given, relative result URLs are resolved against it.
+        """
+        if self.is_blocked(content):
+            logger.warning(f"Anti-bot measures detected on {self.engine}. Skipping further scraping.")
+            ENGINE_ERRORS.inc(engine=self.engine, kind='blocked')
+            engine_health.note_failure(self.engine, 'blocked')
+            return []
+
+        elements = self.find_results(content)
+        if not elements:
+            logger.warning(
+                f"No results found on {self.engine}. This might indicate a parsing issue or a change in its HTML structure.")
+            ENGINE_ERRORS.inc(engine=self.engine, kind='empty')
+            return []
+
+        parsed = []
+        for element in elements:
+            result = self.extract(element, base_url)
+            if result is not None:
+                parsed.append(result)
+        return parsed
+
+
+def json_path(value, path):
+    """Follow a dotted path (data.items, items.0.title) into parsed JSON; None when it does not exist."""
+    for key in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return None
+    return value
+
+
+class JsonResultParser(ResultParser):
+    """
+    Extracts result dictionaries from an engine's JSON search endpoint.
+
+    Selectors are dotted paths instead of XPath: results points at the list
+    of result objects, the fields at values inside one of them. Markup in the
+    values (highlighted query terms, entities) is reduced to text.
+    """
+
+    def __init__(self, engine, results, title=(), url=(), content=(), required=(), defaults=None, block_markers=()):
+        self.engine = engine
+        self.results = list(results)
+        self.fields = {'title': list(title), 'url': list(url), 'content': list(content)}
+        self.required = tuple(required)
+        self.defaults = dict(defaults or {})
+        self.container_start = None
+        self.container_end = None
+        self.block_markers = tuple(block_markers)
+
+    def is_blocked(self, content):
+        # A JSON endpoint answering with an HTML page is showing a verification page
+        return not content.lstrip().startswith(('{', '[')) or super().is_blocked(content)
+
+    def find_results(self, content):
+        try:
+            data = json.loads(content)
+        except ValueError:
+            return []
+        for path in self.results:
+            items = json_path(data, path)
+            if isinstance(items, list) and items:
+                return [item for item in items if isinstance(item, dict)]
+        return []
+
+    def extract_field(self, element, field):
+        for path in self.fields[field]:
+            value = json_path(element, path)
+            if value is None or isinstance(value, (dict, list)):
+                continue
+            value = str(value)
+            if '<' in value or '&' in value:
+                value = html.fragment_fromstring(value, create_parent='div').text_content()
+            if value.strip():
+                return value.strip()
+        return None
@@ -1,69 +1,145 @@
-import json
+import logging
 import os
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+import httpx
+from concurrent.futures import ThreadPoolExecutor, wait
+from cache import TTLCache
+from extract import main_text
+from canonicalize import Canonicalizer
+from transport import ACCEPT_ENCODING, decode, fetch, get_client
+from metrics import registry, timed, timed_stage, FETCHED_BYTES, ENGINE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Enrichment limits: concurrent downloads, seconds per URL and seconds for the whole batch
+ENRICH_MAX_WORKERS = 8
+ENRICH_URL_TIMEOUT = 5
+ENRICH_DEADLINE = 15
+# Per page: bytes and seconds spent reading the body, and characters of text kept
+ENRICH_MAX_BYTES = int(os.environ.get('ENRICH_MAX_BYTES', 512 * 1024))
+ENRICH_READ_SECONDS = float(os.environ.get('ENRICH_READ_SECONDS', 3))
+ENRICH_MAX_CHARS = int(os.environ.get('ENRICH_MAX_CHARS', 5000))
+ENRICH_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+ERROR_CONTENT = ["Anti-scraping measure detected.", "Error fetching content."]
+
+ENRICH_HEADERS = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': ACCEPT_ENCODING}
+
+# Page text keyed by URL so popular pages are not downloaded for every query
+content_cache = TTLCache(max_entries=2000, ttl=3600)
+registry.register_cache('content', lambda: (content_cache.hits, content_cache.misses))
 
 
 class JsonCleaner:
-    def __init__(self):
-        pass
+    def __init__(self, max_workers=ENRICH_MAX_WORKERS, url_timeout=ENRICH_URL_TIMEOUT, deadline=ENRICH_DEADLINE):
+        self.max_workers = max_workers
+        self.url_timeout = url_timeout
+        self.deadline = deadline
+        # The process-wide client, so pages are fetched over pooled connections
+        self.client = get_client()
+        self.cache = content_cache
+        self.canonicalizer = Canonicalizer(self.client)
+        self.stats = {}  # Canonicalization counts of the last clean_json_data() call
 
     def scrape_content(self, url):
-        """Scrape text content from the given URL."""
+        """
+        Scrape the main text of the page at url.
+
+        Only the first ENRICH_MAX_BYTES of the page, read within
+        ENRICH_READ_SECONDS, are downloaded; boilerplate is removed and at
+        most ENRICH_MAX_CHARS characters of text are kept.
+        """
+        cached = self.cache.get(url)
+        if cached is not None:
+            return cached, url
+
         try:
-            response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+            with timed('enrich_fetch'):
+                response, body = fetch(url, headers=ENRICH_HEADERS, timeout=self.url_timeout,
+                                       max_bytes=ENRICH_MAX_BYTES, max_seconds=ENRICH_READ_SECONDS,
+                                       content_types=ENRICH_CONTENT_TYPES, client=self.client)
+            FETCHED_BYTES.inc(len(body), engine='enrich')
             response.raise_for_status()
 
             # Check if the response contains a message indicating anti-scraping measures
-            if "captcha" in response.text.lower() or "blocked" in response.text.lower():
-                print(f"Anti-scraping measure detected at {url}.")
+            page = decode(response, body)
+            lowered = body.lower()
+            if b"captcha" in lowered or b"blocked" in lowered:
+                logger.warning(f"Anti-scraping measure detected at {url}.")
+                ENGINE_ERRORS.inc(engine='enrich', kind='blocked')
                 return "Anti-scraping measure detected.", url
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-            paragraphs = soup.find_all('p')
-            content = ' '.join(p.get_text() for p in paragraphs)
+            with timed('extract'):
+                content = main_text(page, ENRICH_MAX_CHARS)
+            self.cache.set(url, content)
             return content, url
 
-        except requests.RequestException as e:
-            print(f"Error fetching {url}: {e}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Error fetching {url}: {e}")
+            ENGINE_ERRORS.inc(engine='enrich', kind='error')
             return "Error fetching content.", url
 
-    def clean_json_data(self, data):
+    @timed_stage('enrich')
+    def enrich_entries(self, entries):
         """
-        Clean the JSON data by removing invalid entries and updating content.
+        Download page text for entries concurrently.
 
-        :param data: List of dictionaries containing search results.
-        :return: List of cleaned and unique search results.
+        At most max_workers pages are fetched at once. Entries whose page has
+        not arrived when the overall deadline passes keep their current content.
         """
-        unique_entries = []
-        seen = set()
+        entries_by_url = {}
+        for entry in entries:
+            entries_by_url.setdefault(entry['URL'], []).append(entry)
+        if not entries_by_url:
+            return
 
-        for entry in data:
-            # Skip entries without a URL
-            if 'URL' not in entry or not entry['URL']:
-                continue
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(entries_by_url)))
+        futures = {executor.submit(self.scrape_content, url): url for url in entries_by_url}
+        done, not_done = wait(futures, timeout=self.deadline)
+        # Do not wait for stragglers; their URL timeout bounds how long they keep running
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        if not_done:
+            logger.warning(f"Enrichment deadline reached; {len(not_done)} pages skipped.")
 
-            # If there's no title, create one using the search engine name
-            if 'title' not in entry or not entry['title']:
-                entry['title'] = f"{entry.get('engine_name', 'SearchEngine')} Result"
-
-            # Attempt to scrape content if it's missing or indicates an error
-            if 'content' not in entry or not entry['content'] or entry['content'] in ["Anti-scraping measure detected.", "Error fetching content."]:
-                try:
-                    content, new_url = self.scrape_content(entry['URL'])
-                    if content:
-                        entry['content'] = content
-                        entry['URL'] = new_url
-                except Exception as e:
-                    # If scraping fails, keep the original content or set a default message
+        for future in done:
+            url = futures[future]
+            try:
+                content, new_url = future.result()
+            except Exception as e:
+                # If scraping fails, keep the original content or set a default message
+                for entry in entries_by_url[url]:
                     if 'content' not in entry or not entry['content']:
                         entry['content'] = f"Unable to fetch content: {str(e)}"
+                continue
+            if content:
+                for entry in entries_by_url[url]:
+                    entry['content'] = content
+                    entry['URL'] = new_url
+
+    @timed_stage('clean')
+    def clean_json_data(self, data, enrich=True):
+        """
+        Clean the JSON data by removing invalid entries and updating content.
+
+        Results are canonicalized first (see canonicalize.py), so redirect
+        wrappers, tracking parameters and near-duplicate pages are collapsed
+        before anything is downloaded or ranked.
+
+        :param data: List of dictionaries containing search results.
+        :param enrich: Download page text for entries without content.
+        :return: List of cleaned and unique search results.
+        """
+        # Without enrichment (provisional results) no requests are made for opaque redirects either
+        unique_entries, self.stats = self.canonicalizer.canonicalize(data, resolve_redirects=enrich)
+        logger.debug("Canonicalized results", extra={'canonical': self.stats})
+
+        if not enrich:
+            return unique_entries
 
-            # Create a unique identifier for the entry
-            identifier = (entry['title'], entry['URL'])
-            if identifier not in seen:
-                seen.add(identifier)
-                unique_entries.append(entry)
+        # Attempt to scrape content if it's missing or indicates an error
+        self.enrich_entries([
+            entry for entry in unique_entries
+            if 'content' not in entry or not entry['content'] or entry['content'] in ERROR_CONTENT
+        ])
 
         return unique_entries
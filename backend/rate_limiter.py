@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Politeness budget per engine: sustained requests per second, burst size and
+# the maximum random jitter (seconds) added when a request has to wait.
+DEFAULT_RATE_LIMIT = {'rate': 0.5, 'burst': 3, 'jitter': 1.0}
+ENGINE_RATE_LIMITS = {
+    'bing': {'rate': 0.5, 'burst': 5, 'jitter': 1.0},
+    'sogou': {'rate': 0.3, 'burst': 3, 'jitter': 1.5},
+    'quark': {'rate': 0.5, 'burst': 2, 'jitter': 1.0},
+    'mso': {'rate': 0.3, 'burst': 2, 'jitter': 1.5},
+}
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of blocking.
+
+    Every request takes one token. When the bucket is empty the balance goes
+    negative and the caller is told how long to wait for its token, so
+    concurrent callers queue up behind each other in arrival order.
+    """
+
+    def __init__(self, rate, burst, jitter=0.0):
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate + random.uniform(0, self.jitter)
+
+
+class HostRateLimiter:
+    """Shared per-host politeness scheduler for every outgoing search engine request."""
+
+    def __init__(self, limits=None, default=None):
+        self.limits = {engine: dict(limit) for engine, limit in (limits or ENGINE_RATE_LIMITS).items()}
+        self.default = dict(default or DEFAULT_RATE_LIMIT)
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def configure(self, engine, **limit):
+        """Change the rate, burst or jitter of engine; applies to its existing hosts too."""
+        with self._lock:
+            self.limits[engine] = dict(self.limits.get(engine, self.default), **limit)
+            for host, (bucket_engine, _) in list(self._buckets.items()):
+                if bucket_engine == engine:
+                    del self._buckets[host]
+
+    def reserve(self, url, engine=None):
+        """Reserve a request slot for the host of url and return the seconds to wait for it."""
+        host = urlparse(url).hostname or url
+        with self._lock:
+            entry = self._buckets.get(host)
+            if entry is None:
+                limit = self.limits.get(engine, self.default)
+                entry = (engine, TokenBucket(limit['rate'], limit['burst'], limit.get('jitter', 0.0)))
+                self._buckets[host] = entry
+            delay = entry[1].reserve()
+
+            stats = self._stats.setdefault(host, {'requests': 0, 'delayed': 0, 'total_delay': 0.0})
+            stats['requests'] += 1
+            if delay > 0:
+                stats['delayed'] += 1
+                stats['total_delay'] += delay
+
+        if delay > 0:
+            logger.debug(f"Rate limiting {host}: waiting {delay:.2f}s")
+        return delay
+
+    def try_reserve(self, url, engine=None):
+        """Take a request slot for the host of url only if one is free right now; for optional requests."""
+        host = urlparse(url).hostname or url
+        with self._lock:
+            entry = self._buckets.get(host)
+            if entry is not None:
+                bucket = entry[1]
+                bucket.tokens = min(bucket.burst, bucket.tokens + (time.monotonic() - bucket.updated) * bucket.rate)
+                bucket.updated = time.monotonic()
+                if bucket.tokens < 1:
+                    return False
+        return self.reserve(url, engine) <= 0
+
+    def wait(self, url, engine=None):
+        """Block until a request to the host of url is allowed; returns the time waited."""
+        delay = self.reserve(url, engine)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def wait_async(self, url, engine=None):
+        delay = self.reserve(url, engine)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self):
+        """Per-host request counts, delays and the tokens currently available."""
+        with self._lock:
+            snapshot = {}
+            for host, stats in self._stats.items():
+                engine, bucket = self._buckets.get(host, (None, None))
+                snapshot[host] = dict(stats, engine=engine,
+                                      tokens=round(bucket.tokens, 2) if bucket else None)
+            return snapshot
+
+
+# Process wide limiter shared by the sync and async crawlers
+rate_limiter = HostRateLimiter()
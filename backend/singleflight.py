@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; only in-process coalescing is done there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Keys share this many lock files, so the lock directory stays the same size however many keys there are;
+# two keys in one stripe only wait for each other if they are computed at the same time
+LOCK_STRIPES = 256
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    Within a process, the first caller for a key (the leader) runs the
+    function and every other thread asking for that key waits for and shares
+    its result. Across worker processes, leaders take an exclusive lock on
+    the one of lock_stripes files the key hashes to. A worker that had to
+    wait for the lock calls check() first, so it can pick up the result the
+    other worker just stored (for example in a shared cache) instead of
+    computing it again. The lock is released by the OS if the owning process
+    dies, and waiting for it gives up after lock_timeout seconds.
+    """
+
+    def __init__(self, lock_dir=None, lock_timeout=60, lock_stripes=LOCK_STRIPES):
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'mstsearch-locks')
+        self.lock_timeout = lock_timeout
+        self.lock_stripes = lock_stripes
+        self._calls = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, fn, check=None):
+        """
+        Return fn() for key, sharing one execution between concurrent callers.
+
+        :param key: Identifies identical work, e.g. a normalized search key.
+        :param fn: Computes the result.
+        :param check: Optional callable returning an already available result or None.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._process_lock(key) as waited:
+                result = check() if waited and check else None
+                if result is None:
+                    result = fn()
+            call.result = result
+            return result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @contextmanager
+    def _process_lock(self, key):
+        """Hold an exclusive lock on key across processes; yields whether another process held it first."""
+        if fcntl is None:
+            yield False
+            return
+
+        stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % self.lock_stripes
+        path = os.path.join(self.lock_dir, f"{stripe}.lock")
+        with open(path, 'a') as lock_file:
+            waited = False
+            deadline = time.monotonic() + self.lock_timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"Timed out waiting for the lock on {key}; running without it")
+                        locked = False
+                        break
+                    time.sleep(0.05)
+            try:
+                yield waited
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
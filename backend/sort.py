@@ -1,104 +1,252 @@
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict
 import jieba
 import numpy as np
-from gensim.models import Word2Vec
-from rank_bm25 import BM25Okapi
+from gensim.models import KeyedVectors
+from scipy.sparse import csr_matrix
 from sklearn.metrics.pairwise import cosine_similarity as sk_cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-import warnings
+from sklearn.feature_extraction.text import TfidfTransformer
+from metrics import registry, timed, timed_stage
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters, same defaults as rank_bm25.BM25Okapi
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+# Relative weight of each signal in the fused score
+DEFAULT_WEIGHTS = {'bm25': 1.0, 'tfidf': 1.0, 'word2vec': 1.0}
+
+# Pretrained word vectors saved with gensim's KeyedVectors.save(); for word2vec
+# text/binary files convert once with KeyedVectors.load_word2vec_format(...).save(path).
+# When unset, the embedding signal is skipped and results are ranked by BM25 and TF-IDF.
+WORD_VECTORS_PATH = os.environ.get('WORD_VECTORS_PATH')
+
+_word_vectors = None
+_word_vectors_lock = threading.Lock()
+
+
+def load_word_vectors(path=WORD_VECTORS_PATH):
+    """Load the pretrained embeddings once per process, memory-mapped so worker processes share the pages."""
+    global _word_vectors
+    if not path:
+        return None
+    with _word_vectors_lock:
+        if _word_vectors is None:
+            _word_vectors = KeyedVectors.load(path, mmap='r')
+        return _word_vectors
+
+
+# Total length of the texts whose tokens are cached; text plus tokens take about 30 bytes per character
+TOKENIZE_CACHE_CHARS = int(os.environ.get('TOKENIZE_CACHE_CHARS', 1_000_000))
+
+
+class TokenCache:
+    """Thread-safe LRU cache of tokenized texts, bounded by their total length rather than their number."""
+
+    def __init__(self, max_chars=TOKENIZE_CACHE_CHARS):
+        self.max_chars = max_chars
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text):
+        with self._lock:
+            tokens = self._entries.get(text)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+            return tokens
+
+    def set(self, text, tokens):
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            if text not in self._entries:
+                self.chars += len(text)
+            self._entries[text] = tokens
+            while self.chars > self.max_chars:
+                evicted, _ = self._entries.popitem(last=False)
+                self.chars -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.chars = 0
+
+
+token_cache = TokenCache()
+registry.register_cache('tokenize', lambda: (token_cache.hits, token_cache.misses))
+
+
+def tokenize(text):
+    """Lowercase and segment text with jieba; cached because the same pages recur across queries."""
+    tokens = token_cache.get(text)
+    if tokens is None:
+        tokens = tuple(jieba.cut(text.lower()))
+        token_cache.set(text, tokens)
+    return tokens
 
-warnings.filterwarnings("ignore", message="The parameter 'token_pattern' will not be used since 'tokenizer' is not None")
 
 class Sort:
-    def __init__(self, search_results, query):
+    def __init__(self, search_results, query, word_vectors=None, weights=None, top_k=None):
         self.search_results = search_results  # Now accepts the search results directly
         self.query = query
         self.documents = [result['content'] for result in self.search_results]
-        self.tokenized_docs = [list(jieba.cut(doc)) for doc in self.documents]
-        self.bm25 = None
-        self.vectorizer = None
-        self.word2vec_model = None
+        # Documents are tokenized once; BM25, TF-IDF and embeddings all work from these tokens
+        with timed('tokenize'):
+            self.tokenized_docs = [tokenize(doc) for doc in self.documents]
+            self.vocabulary, self.term_matrix = self.build_term_matrix(self.tokenized_docs)
+        self.word_vectors = word_vectors if word_vectors is not None else load_word_vectors()
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        if self.word_vectors is None:
+            self.weights['word2vec'] = 0
+        self.top_k = top_k
+
+    @staticmethod
+    def build_term_matrix(tokenized_docs):
+        """Build the shared vocabulary and the sparse document x term frequency matrix."""
+        vocabulary = {}
+        indptr, indices, counts = [0], [], []
+        for tokens in tokenized_docs:
+            term_counts = Counter(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            indices.extend(term_counts.keys())
+            counts.extend(term_counts.values())
+            indptr.append(len(indices))
+        term_matrix = csr_matrix((counts, indices, indptr), shape=(len(tokenized_docs), len(vocabulary)),
+                                 dtype=np.float64)
+        return vocabulary, term_matrix
 
     def tokenize_query(self):
-        return list(jieba.cut(self.query))
+        return list(tokenize(self.query))
 
+    def query_term_indices(self, query_tokens):
+        return [self.vocabulary[token] for token in query_tokens if token in self.vocabulary]
+
+    @timed_stage('bm25')
     def compute_bm25_scores(self, query_tokens):
-        self.bm25 = BM25Okapi(self.tokenized_docs)
-        return self.bm25.get_scores(query_tokens)
+        # Okapi BM25 over the shared term matrix, matching rank_bm25.BM25Okapi
+        n_docs = self.term_matrix.shape[0]
+        term_indices = self.query_term_indices(query_tokens)
+        if not term_indices:
+            return np.zeros(n_docs)
+
+        doc_freqs = np.bincount(self.term_matrix.indices, minlength=len(self.vocabulary))
+        idf = np.log(n_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        idf[idf < 0] = BM25_EPSILON * idf.mean()
+
+        doc_lengths = np.asarray(self.term_matrix.sum(axis=1)).ravel()
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / (doc_lengths.mean() or 1))
+
+        term_freqs = self.term_matrix[:, term_indices].toarray()
+        return (idf[term_indices] * term_freqs * (BM25_K1 + 1) / (term_freqs + length_norm[:, None])).sum(axis=1)
 
+    @timed_stage('tfidf')
     def compute_tfidf_scores(self, query_tokens):
-        self.vectorizer = TfidfVectorizer(tokenizer=jieba.cut)
-        tfidf_matrix = self.vectorizer.fit_transform(self.documents)
-        query_vector = self.vectorizer.transform([self.query])
+        transformer = TfidfTransformer()
+        tfidf_matrix = transformer.fit_transform(self.term_matrix)
+        query_counts = np.bincount(self.query_term_indices(query_tokens), minlength=len(self.vocabulary))
+        query_vector = transformer.transform(csr_matrix(query_counts, dtype=np.float64))
         return sk_cosine_similarity(query_vector, tfidf_matrix).flatten()
 
+    @staticmethod
+    def mean_vectors(token_lists, keyed_vectors):
+        """Average the vectors of each token list with one vectorized lookup; unknown tokens are skipped."""
+        key_to_index = keyed_vectors.key_to_index
+        indices = [[key_to_index[token] for token in tokens if token in key_to_index] for tokens in token_lists]
+        counts = np.array([len(doc_indices) for doc_indices in indices])
+        flat_indices = np.fromiter((index for doc_indices in indices for index in doc_indices), dtype=np.int64)
+
+        sums = np.zeros((len(token_lists), keyed_vectors.vector_size), dtype=np.float32)
+        if flat_indices.size:
+            # Fancy indexing copies only the needed rows out of a memory-mapped matrix
+            np.add.at(sums, np.repeat(np.arange(len(token_lists)), counts), keyed_vectors.vectors[flat_indices])
+        return sums / np.maximum(counts, 1)[:, None]
+
+    def compute_embedding_scores(self, query_tokens, keyed_vectors):
+        # One matrix cosine between the query and every document; higher means closer to the query.
+        # Documents pointing away from the query score 0 like unrelated ones.
+        vectors = self.mean_vectors([query_tokens] + list(self.tokenized_docs), keyed_vectors)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1
+        vectors = vectors / norms[:, None]
+        return np.clip(vectors[1:] @ vectors[0], 0, None)
+
+    @timed_stage('word2vec')
     def compute_word2vec_scores(self, query_tokens):
-        self.word2vec_model = Word2Vec(sentences=self.tokenized_docs, vector_size=100, window=5, min_count=1, workers=4)
-        query_vector_w2v = np.mean([self.word2vec_model.wv[word] for word in query_tokens if word in self.word2vec_model.wv] or [
-            np.zeros(self.word2vec_model.vector_size)], axis=0)
-        doc_vectors_w2v = np.array([np.mean(
-            [self.word2vec_model.wv[word] for word in doc if word in self.word2vec_model.wv] or [np.zeros(self.word2vec_model.vector_size)],
-            axis=0) for doc in self.tokenized_docs])
-        return np.array(
-            [1 - sk_cosine_similarity([query_vector_w2v], [doc_vector])[0][0] for doc_vector in doc_vectors_w2v])
+        return self.compute_embedding_scores(query_tokens, self.word_vectors)
 
+    @timed_stage('fusion')
     def normalize_scores(self, bm25_scores, cosine_similarities, w2v_similarities):
-        bm25_score_max = np.max(bm25_scores) if bm25_scores.size > 0 else 1
-        cosine_score_max = np.max(cosine_similarities) if cosine_similarities.size > 0 else 1
-        w2v_score_max = np.max(w2v_similarities) if w2v_similarities.size > 0 else 1
+        """Scale each signal to 0-100 by its maximum and fuse them with the configured weights."""
+        signals = np.vstack([bm25_scores, cosine_similarities, w2v_similarities]).astype(np.float64)
+        maxima = signals.max(axis=1, keepdims=True) if signals.shape[1] else np.ones((3, 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized = np.where(maxima != 0, signals / np.where(maxima != 0, maxima, 1) * 100, 0)
+
+        weights = np.array([self.weights['bm25'], self.weights['tfidf'], self.weights['word2vec']], dtype=np.float64)
+        combined = weights @ normalized / weights.sum()
+        return np.where(np.isnan(combined), 0.01, np.round(combined, 2))
+
+    def handle_anti_scraping(self, scores):
+        blocked = np.array(["Anti-scraping measure detected." in result.get('content', '')
+                            for result in self.search_results], dtype=bool)
+        positive = scores[scores > 0]
+        average_score = positive.mean() if positive.size else 0.01
+
+        replace = (scores == 0) | blocked
+        return np.where(replace, round(max(average_score, 0.01), 2), scores)
+
+    @timed_stage('order')
+    def sort_results(self, scores):
+        """Order results by descending score; with top_k only the best top_k are selected and returned."""
+        if self.top_k is not None and self.top_k < scores.size:
+            candidates = np.argpartition(-scores, self.top_k - 1)[:self.top_k]
+        else:
+            candidates = np.arange(scores.size)
+        # Stable: equal scores keep their original order
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
 
         final_scores = []
-        for i, result in enumerate(self.search_results):
-            bm25_score = (bm25_scores[i] / bm25_score_max) * 100 if bm25_score_max != 0 else 0
-            cosine_score = (cosine_similarities[i] / cosine_score_max) * 100 if cosine_score_max != 0 else 0
-            w2v_score = (w2v_similarities[i] / w2v_score_max) * 100 if w2v_score_max != 0 else 0
-
-            combined_score = (bm25_score + cosine_score + w2v_score) / 3
-
+        for i in order:
+            result = self.search_results[i]
             final_scores.append({
                 'title': result.get('title', 'No Title'),  # Add default if title is missing
                 'content': result.get('content', 'No Content'),  # Add default if content is missing
                 'URL': result.get('URL', '#'),  # Add default if URL is missing
                 'engine_name': result.get('engine_name', 'Unknown'),  # Add engine_name
-                'score': round(combined_score, 2) if not np.isnan(combined_score) else 0.01
+                'score': float(scores[i])
             })
-
         return final_scores
 
-    def handle_anti_scraping(self, final_scores):
-        average_score = np.mean([item['score'] for item in final_scores if item['score'] > 0]) if final_scores else 0.01
-
-        for result in final_scores:
-            if result['score'] == 0 or "Anti-scraping measure detected." in result.get('content', ''):
-                result['score'] = max(average_score, 0.01)
-
-        return final_scores
-
-    def sort_results(self, final_scores):
-        # Sort the results but return all of them
-        return sorted(final_scores, key=lambda x: x['score'], reverse=True)
-
     def run_sorting(self):
         query_tokens = self.tokenize_query()
         try:
             bm25_scores = self.compute_bm25_scores(query_tokens)
         except Exception as e:
-            print(f"Error in BM25 scoring: {e}")
+            logger.error(f"Error in BM25 scoring: {e}")
             bm25_scores = np.zeros(len(self.search_results))
 
         try:
             cosine_similarities = self.compute_tfidf_scores(query_tokens)
         except Exception as e:
-            print(f"Error in TF-IDF scoring: {e}")
+            logger.error(f"Error in TF-IDF scoring: {e}")
             cosine_similarities = np.zeros(len(self.search_results))
 
-        try:
-            w2v_similarities = self.compute_word2vec_scores(query_tokens)
-        except Exception as e:
-            print(f"Error in Word2Vec scoring: {e}")
-            w2v_similarities = np.zeros(len(self.search_results))
-
-        final_scores = self.normalize_scores(bm25_scores, cosine_similarities, w2v_similarities)
-        final_scores = self.handle_anti_scraping(final_scores)
-        sorted_results = self.sort_results(final_scores)
+        w2v_similarities = np.zeros(len(self.search_results))
+        if self.word_vectors is not None:
+            try:
+                w2v_similarities = self.compute_word2vec_scores(query_tokens)
+            except Exception as e:
+                logger.error(f"Error in Word2Vec scoring: {e}")
 
-        return sorted_results
+        scores = self.normalize_scores(bm25_scores, cosine_similarities, w2v_similarities)
+        scores = self.handle_anti_scraping(scores)
+        return self.sort_results(scores)
@@ -1,46 +1,82 @@
 import json
-import importlib
+import os
+from answer_context import ContextBuilder
+from llm_clients import ANSWER_HEDGE_AFTER, client_registry, race, stream_completion
+
+# Model of the same provider that hedges or replaces a slow or failing model
+FALLBACK_MODEL = os.environ.get('ANSWER_FALLBACK_MODEL', 'gpt-4')
 
 
 class AIQuestionAnswerer:
-    def __init__(self, api_key, provider, model, search_results_file, question):
+    def __init__(self, api_key, provider, model, search_results, question, context_builder=None,
+                 fallback_model=FALLBACK_MODEL):
         self.api_key = api_key
         self.provider = provider
         self.model = model
-        self.search_results_file = search_results_file
+        self.fallback_model = fallback_model if fallback_model != model else None
+        self.search_results = search_results  # Ranked results of one search
         self.question = question
-        self.lc = None
-        self._initialize_provider()
+        self.context_builder = context_builder or ContextBuilder()
+        self.answered_by = None  # Model that produced the answer
+        self._context = None
 
-    def _initialize_provider(self):
-        # Dynamically import the provider package
-        package_name = f"langchain-{self.provider.lower()}"
-        provider_module = importlib.import_module(package_name)
+    @property
+    def used_fallback(self):
+        return self.answered_by is not None and self.answered_by != self.model
 
-        # Initialize LangChain with the chosen model
-        self.lc = provider_module.LangChain(api_key=self.api_key, model=self.model)
+    @property
+    def context(self):
+        """Prompt context, built once; the answer cache keys on it too."""
+        if self._context is None:
+            # Only the passages most relevant to the question fit in the token budget
+            self._context = self.context_builder.build(self.search_results, self.question)
+        return self._context
 
-    def _load_search_results(self):
-        # Load search results with scores from the JSON file
-        with open(self.search_results_file, 'r') as file:
-            search_results = json.load(file)
+    def build_prompt(self):
+        # Create a prompt with the search results as context and the user's question
+        return f"Context:\n{self.context}\n\nQuestion: {self.question}\n\nAnswer:"
 
-        # Convert search results to a string with scores
-        search_results_str = "\n".join([
-            f"Title: {result['title']}\nContent: {result['content']}\nURL: {result['URL']}\nScore: {result['score']}"
-            for result in search_results
-        ])
-        return search_results_str
+    def _model_calls(self, prompt, streaming):
+        """(label, call) pairs for the primary and fallback model; both share the one prompt."""
+        def model_call(model):
+            def call():
+                # Clients are cached per provider, model and key instead of being set up per request
+                client = client_registry.get(self.provider, model, self.api_key)
+                return stream_completion(client, prompt) if streaming else iter([client(prompt)])
+            return model, call
 
-    def answer_question(self):
-        search_results_str = self._load_search_results()
+        fallback = model_call(self.fallback_model) if self.fallback_model else None
+        return model_call(self.model), fallback
 
-        # Create a prompt with the search results as context and the user's question
-        prompt = f"Context:\n{search_results_str}\n\nQuestion: {self.question}\n\nAnswer:"
+    def hedge_after(self, streaming):
+        """
+        Seconds to wait for the primary model's first chunk before also asking
+        the fallback model. Only clients that really stream are hedged: for the
+        others the first chunk is the whole answer, and the abandoned call
+        cannot be cancelled, so hedging them would pay for most answers twice.
+        """
+        if not streaming:
+            return None
+        try:
+            client = client_registry.get(self.provider, self.model, self.api_key)
+        except Exception:
+            return None  # The primary call fails as well, which starts the fallback
+        return ANSWER_HEDGE_AFTER if hasattr(client, 'stream') else None
+
+    def stream_answer(self):
+        """Yield the answer in chunks as the model produces them."""
+        calls = self._model_calls(self.build_prompt(), streaming=True)
+        for model, chunk in race(*calls, hedge_after=self.hedge_after(streaming=True)):
+            self.answered_by = model
+            yield chunk
 
-        # Get the answer from the model
-        response = self.lc(prompt)
-        return response
+    def answer_question(self):
+        chunks = []
+        calls = self._model_calls(self.build_prompt(), streaming=False)
+        for model, chunk in race(*calls, hedge_after=self.hedge_after(streaming=False)):
+            self.answered_by = model
+            chunks.append(chunk)
+        return chunks[0] if len(chunks) == 1 else ''.join(chunks)
 
 
 # Example usage
@@ -49,11 +85,12 @@ if __name__ == "__main__":
     api_key = "your_api_key_here"
     provider = "OpenAILLM"
     model = "gpt-4"
-    search_results_file = "sorted_results.json"
+    with open("sorted_results.json", 'r', encoding='utf-8') as file:
+        search_results = json.load(file)
     question = "What is the main topic of the search results?"
 
     # Instantiate and use the AIQuestionAnswerer
-    ai_answerer = AIQuestionAnswerer(api_key, provider, model, search_results_file, question)
+    ai_answerer = AIQuestionAnswerer(api_key, provider, model, search_results, question)
     answer = ai_answerer.answer_question()
     print("Answer:")
     print(answer)
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The backend modules are imported flat, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep caches in memory and browsers closed while the app is imported
+os.environ.setdefault('SEARCH_CACHE_BACKEND', 'memory')
+os.environ.setdefault('ANSWER_CACHE_BACKEND', 'memory')
+os.environ.setdefault('DRIVER_POOL_PREWARM', '0')
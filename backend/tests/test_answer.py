@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import app as app_module
+from cache import make_search_key, search_id_from_key
+
+RESULTS = [
+    {'title': 'Python 爬虫入门', 'content': '用 Python 编写网络爬虫的基础教程。', 'URL': 'https://example.com/a',
+     'engine_name': 'Bing', 'score': 90.0},
+    {'title': 'Scrapy 文档', 'content': 'Scrapy 是一个 Python 爬虫框架。', 'URL': 'https://example.com/b',
+     'engine_name': 'Sogou', 'score': 80.0},
+]
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def search_id():
+    key = make_search_key('python 爬虫', [{'name': 'bing', 'resultsCount': 10}])
+    app_module.search_cache.set(key, {'status': 'success', 'results': RESULTS})
+    return search_id_from_key(key)
+
+
+def frames(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+
+
+def ask(client, search_id, question, **options):
+    payload = dict(question=question, search_id=search_id, provider='stub', model='small', api_key='key', **options)
+    return client.post('/answer', json=payload)
+
+
+def test_streamed_answer(client, search_id):
+    response = ask(client, search_id, 'What is Scrapy?', stream=True)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    received = frames(response)
+    assert [frame['type'] for frame in received[:-1]] == ['token'] * (len(received) - 1)
+    assert ''.join(frame['text'] for frame in received[:-1]) == "Stub answer from small to: What is Scrapy?"
+    assert received[-1] == {'type': 'done', 'model': 'small', 'fallback': False}
+
+
+def test_streamed_answer_is_cached(client, search_id):
+    ask(client, search_id, 'Which framework is mentioned?', stream=True).get_data()
+
+    received = frames(ask(client, search_id, 'Which framework is mentioned?', stream=True))
+    assert received[0] == {'type': 'token', 'text': "Stub answer from small to: Which framework is mentioned?"}
+    assert received[1]['type'] == 'done'
+    assert received[1]['cached'] is True
+
+
+def test_json_answer(client, search_id):
+    response = ask(client, search_id, 'Is there a tutorial?')
+    assert response.status_code == 200
+    assert response.get_json() == {'answer': "Stub answer from small to: Is there a tutorial?"}
+
+
+def test_answer_requires_a_known_search(client):
+    assert ask(client, 'not-a-search-id', 'Anything?').status_code == 400
+    assert ask(client, '0' * 40, 'Anything?').status_code == 404
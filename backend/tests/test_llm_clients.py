@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from llm_clients import ClientRegistry, StubLLM, race, stream_completion
+
+
+def chunks(*values, delay=0):
+    def call():
+        for value in values:
+            if delay:
+                time.sleep(delay)
+            yield value
+    return call
+
+
+def failing(error):
+    def call():
+        raise error
+    return call
+
+
+def test_registry_reuses_clients_per_provider_model_and_key():
+    registry = ClientRegistry()
+    client = registry.get('stub', 'small', 'key')
+    assert isinstance(client, StubLLM)
+    assert registry.get('STUB', 'small', 'key') is client
+    assert registry.get('stub', 'small', 'other key') is not client
+    assert registry.get('stub', 'large', 'key') is not client
+
+
+def test_registry_drops_least_recently_used_client():
+    registry = ClientRegistry(max_clients=2)
+    first = registry.get('stub', 'a', None)
+    registry.get('stub', 'b', None)
+    registry.get('stub', 'a', None)
+    registry.get('stub', 'c', None)
+    assert registry.get('stub', 'a', None) is first
+    assert len(registry._clients) == 2
+
+
+def test_registry_requires_a_provider():
+    with pytest.raises(ValueError):
+        ClientRegistry().get(None, 'model', 'key')
+
+
+def test_stub_streams_its_answer():
+    client = StubLLM(model='small')
+    prompt = "Context:\n...\n\nQuestion: What is it?\n\nAnswer:"
+    assert ''.join(stream_completion(client, prompt)) == "Stub answer from small to: What is it?"
+    assert client(prompt) == "Stub answer from small to: What is it?"
+
+
+def test_race_uses_the_primary_when_it_answers_in_time():
+    result = list(race(('primary', chunks('a', 'b')), ('fallback', chunks('x')), hedge_after=1))
+    assert result == [('primary', 'a'), ('primary', 'b')]
+
+
+def test_race_hedges_a_primary_without_first_chunk():
+    result = list(race(('primary', chunks('late', delay=1)), ('fallback', chunks('x', 'y')), hedge_after=0.05))
+    assert result == [('fallback', 'x'), ('fallback', 'y')]
+
+
+def test_race_without_hedge_after_waits_for_the_primary():
+    started = []
+
+    def fallback():
+        started.append(True)
+        return iter(['x'])
+
+    result = list(race(('primary', chunks('whole answer', delay=0.2)), ('fallback', fallback), hedge_after=None))
+    assert result == [('primary', 'whole answer')]
+    assert not started
+
+
+def test_race_falls_back_when_the_primary_fails():
+    result = list(race(('primary', failing(RuntimeError('down'))), ('fallback', chunks('x')), hedge_after=None))
+    assert result == [('fallback', 'x')]
+
+
+def test_race_raises_when_every_model_fails():
+    with pytest.raises(RuntimeError):
+        list(race(('primary', failing(RuntimeError('down'))), ('fallback', failing(RuntimeError('down too')))))
+
+
+def test_race_times_out_at_the_deadline():
+    with pytest.raises(TimeoutError):
+        list(race(('primary', chunks('late', delay=1)), hedge_after=None, deadline=0.05))
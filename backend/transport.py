@@ -0,0 +1,268 @@
+"""
+Process-wide HTTP transport shared by the crawlers, the cleaner and
+canonicalization.
+
+All requests go through one httpx client per process (plus one async client
+per event loop) with keep-alive connection pools per host, HTTP/2 when the
+optional h2 package is installed, and a single SSL context, so CA
+certificates are loaded once and connections are reused across searches.
+Host name lookups of these clients (and only these) are cached in-process.
+Response bodies are decompressed
+incrementally as they stream in, and fetch() can stop reading at a size
+limit without downloading or inflating the rest.
+"""
+import codecs
+import importlib.util
+import ipaddress
+import logging
+import os
+import re
+import socket
+import ssl
+import threading
+import time
+
+import anyio
+import certifi
+import httpcore
+import httpx
+
+from cache import TTLCache
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+HTTP2 = os.environ.get('HTTP2', '1') == '1' and importlib.util.find_spec('h2') is not None
+# Host name lookups are cached for the records' TTL (with the optional dnspython package), at most DNS_CACHE_TTL
+# seconds; lookups through the system resolver, which does not report TTLs, are cached for DNS_FALLBACK_TTL
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))
+DNS_FALLBACK_TTL = int(os.environ.get('DNS_FALLBACK_TTL', 60))
+DNS_CACHE_SIZE = 1000
+DNS_LOOKUP_TIMEOUT = 5
+# Addresses of a host tried per connection attempt before it fails
+MAX_CONNECT_ADDRESSES = 2
+DNSPYTHON = importlib.util.find_spec('dns') is not None
+if DNSPYTHON:
+    import dns.exception
+    import dns.resolver
+DEFAULT_TIMEOUT = httpx.Timeout(10, connect=5)
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=32, keepalive_expiry=60)
+# Connection failures are retried once; engines that keep failing are skipped by their circuit breaker
+CONNECT_RETRIES = 1
+CHUNK_SIZE = 16384
+
+# Charset declared by the page itself, looked for in its first bytes
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+META_CHARSET_BYTES = 4096
+# Tried in this order when neither the headers nor the page declare a charset
+FALLBACK_ENCODINGS = ('utf-8', 'gb18030')
+
+# Only advertise the encodings httpx can decode here
+ACCEPT_ENCODING = ', '.join(['gzip', 'deflate'] + (['br'] if importlib.util.find_spec('brotli') else []))
+
+ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def lookup(host, port):
+    """(addresses of host, seconds they may be cached); raises OSError when host does not resolve."""
+    if DNSPYTHON:
+        addresses, ttls = [], []
+        for record_type in ('A', 'AAAA'):
+            try:
+                answer = dns.resolver.resolve(host, record_type, lifetime=DNS_LOOKUP_TIMEOUT)
+            except dns.exception.DNSException:
+                continue
+            addresses.extend(record.address for record in answer)
+            ttls.append(answer.rrset.ttl)
+        if addresses:
+            return addresses, min(ttls)
+        # Names only the system knows (/etc/hosts, search domains) are left to getaddrinfo
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos)), DNS_FALLBACK_TTL
+
+
+class DNSCache:
+    """Addresses of host names, each cached for its TTL but at most max_ttl seconds; failures are not cached."""
+
+    def __init__(self, max_ttl=DNS_CACHE_TTL, max_entries=DNS_CACHE_SIZE):
+        self.max_ttl = max_ttl
+        self.cache = TTLCache(max_entries=max_entries, ttl=max_ttl)
+
+    def get(self, host, port):
+        return self.cache.get((host, port))
+
+    def resolve(self, host, port):
+        """Addresses to connect to for host; raises httpcore.ConnectError when it does not resolve."""
+        addresses = self.get(host, port)
+        if addresses is None:
+            try:
+                addresses, ttl = lookup(host, port)
+            except OSError as e:
+                raise httpcore.ConnectError(f"Could not resolve {host}: {e}") from e
+            self.cache.set((host, port), addresses, ttl=min(ttl, self.max_ttl))
+        return addresses
+
+    def forget(self, host, port):
+        """Drop the addresses of host after none of them could be connected to."""
+        self.cache.delete((host, port))
+
+
+class CachingNetworkBackend(httpcore.NetworkBackend):
+    """httpcore network backend that connects to cached addresses of host names (TLS still uses the name)."""
+
+    def __init__(self, backend, dns_cache):
+        self.backend = backend
+        self.dns_cache = dns_cache
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if is_ip_address(host):
+            return self.backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        error = None
+        for address in self.dns_cache.resolve(host, port)[:MAX_CONNECT_ADDRESSES]:
+            try:
+                return self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        self.dns_cache.forget(host, port)
+        raise error
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    def sleep(self, seconds):
+        self.backend.sleep(seconds)
+
+
+class AsyncCachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """Async version of CachingNetworkBackend; uncached lookups run on a worker thread."""
+
+    def __init__(self, backend, dns_cache):
+        self.backend = backend
+        self.dns_cache = dns_cache
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if is_ip_address(host):
+            return await self.backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        addresses = self.dns_cache.get(host, port)
+        if addresses is None:
+            addresses = await anyio.to_thread.run_sync(self.dns_cache.resolve, host, port)
+        error = None
+        for address in addresses[:MAX_CONNECT_ADDRESSES]:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        self.dns_cache.forget(host, port)
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+def with_dns_cache(transport, backend_class):
+    """Route the connections of an httpx transport through dns_cache."""
+    # httpx takes no network backend argument, so the one of its connection pool is wrapped
+    pool = transport._pool
+    pool._network_backend = backend_class(pool._network_backend, dns_cache)
+    return transport
+
+
+dns_cache = DNSCache()
+registry.register_cache('dns', lambda: (dns_cache.cache.hits, dns_cache.cache.misses))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide synchronous client; thread safe."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            transport = httpx.HTTPTransport(verify=ssl_context, http2=HTTP2, limits=LIMITS, retries=CONNECT_RETRIES)
+            _client = httpx.Client(
+                transport=with_dns_cache(transport, CachingNetworkBackend),
+                timeout=DEFAULT_TIMEOUT,
+                follow_redirects=True,
+            )
+            logger.debug(f"Created shared HTTP client (HTTP/2: {HTTP2})")
+        return _client
+
+
+def create_async_client():
+    """An async client with the shared settings; create one per event loop, on that loop."""
+    transport = httpx.AsyncHTTPTransport(verify=ssl_context, http2=HTTP2, limits=LIMITS, retries=CONNECT_RETRIES)
+    return httpx.AsyncClient(
+        transport=with_dns_cache(transport, AsyncCachingNetworkBackend),
+        timeout=DEFAULT_TIMEOUT,
+        follow_redirects=True,
+    )
+
+
+def read_body(response, max_bytes=None, max_seconds=None):
+    """Read the decompressed body of a streamed response chunk by chunk, stopping after max_bytes or max_seconds."""
+    chunks, size = [], 0
+    stop_at = time.monotonic() + max_seconds if max_seconds is not None else None
+    for chunk in response.iter_bytes(CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if max_bytes is not None and size >= max_bytes:
+            break
+        if stop_at is not None and time.monotonic() >= stop_at:
+            logger.debug(f"Stopped reading {response.url} after {max_seconds}s ({size} bytes)")
+            break
+    body = b''.join(chunks)
+    return body if max_bytes is None else body[:max_bytes]
+
+
+def decode(response, body):
+    """
+    Body as text in the charset the response headers or the page's <meta>
+    tag declare. Undeclared (or unknown) charsets are detected by trying
+    FALLBACK_ENCODINGS; a character cut off by a size limit at the end of
+    body is dropped rather than failing detection.
+    """
+    charset = response.charset_encoding
+    if not charset:
+        match = META_CHARSET.search(body[:META_CHARSET_BYTES])
+        charset = match.group(1).decode('ascii') if match else None
+    if charset:
+        try:
+            return body.decode(charset, 'replace')
+        except LookupError:
+            pass
+    for encoding in FALLBACK_ENCODINGS:
+        try:
+            return codecs.getincrementaldecoder(encoding)().decode(body, final=False)
+        except UnicodeDecodeError:
+            continue
+    return body.decode('utf-8', 'replace')
+
+
+def fetch(url, headers=None, timeout=DEFAULT_TIMEOUT, max_bytes=None, max_seconds=None, content_types=None,
+          follow_redirects=True, client=None):
+    """
+    GET url through the shared client and return (response, body).
+
+    The body is decompressed while it streams in; with max_bytes or
+    max_seconds the connection is released as soon as that much has been
+    read. With content_types, the body of a response whose Content-Type
+    matches none of them is not read at all (body is b'').
+    """
+    client = client or get_client()
+    with client.stream('GET', url, headers=headers, timeout=timeout, follow_redirects=follow_redirects) as response:
+        content_type = response.headers.get('Content-Type', '').lower()
+        if content_types and content_type and not content_type.startswith(content_types):
+            return response, b''
+        return response, read_body(response, max_bytes, max_seconds)